@@ -1,25 +1,54 @@
+import time
+STARTED = time.perf_counter()
+
+import argparse
+import contextlib
 import os
 import json
 import datetime
+import logging
 import re
+import sys
 import tkinter as tk
 import ttkbootstrap as ttk
 from ttkbootstrap.constants import *
 from tkinter import messagebox, simpledialog
 from ttkbootstrap.widgets import DateEntry, Checkbutton, Menubutton
-import jsonschema
 import hashlib
-import requests
-from PIL import Image, ImageTk
 import io
+import queue
+from concurrent.futures import ThreadPoolExecutor
+# The store, jsonschema, requests and PIL are imported on first use (mostly
+# on worker threads), so the window shows up before they are loaded.
 
 date_entry_available = True
 
+log = logging.getLogger(__name__)
 
 # File and folder paths
 JSON_DIR = "Json"
 INGREDIENTS_FILE = os.path.join(JSON_DIR, "Ingredients.json")
 SCHEMA_FILE = os.path.join(JSON_DIR, "Ingredient_Schema.json")
+GTIN_CACHE_FILE = os.path.join(JSON_DIR, "gtin_cache.db")
+IMAGE_CACHE_DIR = os.path.join(JSON_DIR, "images")
+
+# Startup timing: (step, seconds, seconds since start) of every measured startup step
+IMPORTED = time.perf_counter() - STARTED
+STARTUP_STEPS = [("import GUI modules", IMPORTED, IMPORTED)]
+
+@contextlib.contextmanager
+def startup_step(step):
+    """Measure a step of the startup for --startup-timing."""
+    start = time.perf_counter()
+    yield
+    end = time.perf_counter()
+    STARTUP_STEPS.append((step, end - start, end - STARTED))
+
+def print_startup_times(file=sys.stderr):
+    """Print the startup steps in order of completion, like python -X importtime."""
+    print("startup:    self [ms] |    at [ms] | step", file=file)
+    for step, seconds, at in sorted(STARTUP_STEPS, key=lambda item: item[2]):
+        print(f"startup: {seconds * 1000:12.1f} | {at * 1000:10.1f} | {step}", file=file)
 
 def ensure_files_exist():
     """Ensure that the Json folder and Ingredients.json file exist.
@@ -34,38 +63,27 @@ def ensure_files_exist():
         messagebox.showerror("Error", "Ingredient_Schema.json not found in the Json folder.")
         exit(1)
 
-def load_database():
-    """Load the ingredients database from file."""
-    with open(INGREDIENTS_FILE, "r") as f:
-        try:
-            return json.load(f)
-        except Exception:
-            return []
-
-def save_database(db):
-    """Save the ingredients database to file."""
-    with open(INGREDIENTS_FILE, "w") as f:
-        json.dump(db, f, indent=4)
-
-def load_schema():
-    """Load the JSON schema for ingredients."""
-    with open(SCHEMA_FILE, "r") as f:
-        return json.load(f)
-
-def get_unique_dropdown_options(db, key):
-    """Collect unique values from the database for the given key.
-       For 'unit' (which is inside the size object) the lookup is done differently."""
-    values = set()
-    for entry in db:
-        if key == "unit":
-            if "size" in entry and "unit" in entry["size"]:
-                values.add(entry["size"]["unit"])
-        elif key == "place":  # Places are inside the "location" object
-            if "location" in entry and "place" in entry["location"]:
-                values.add(entry["location"]["place"])
-        elif key in entry:
-            values.add(entry[key])
-    return sorted(list(values))
+def get_dropdown_options(facets, facet):
+    """Return the values in use for a facet (e.g. "location.place"), sorted."""
+    return [str(value) for value in facets.get(facet, {})]
+
+def load_image(gtin_cache, gtin):
+    """Load the 180x180 thumbnail of a product image from the image cache,
+       which downloads and shrinks it only once (runs on a worker thread).
+       Returns the PIL image, or None if it could not be loaded."""
+    from PIL import Image
+    from image_cache import get_image_cache
+    try:
+        thumbnail = get_image_cache(IMAGE_CACHE_DIR, gtin_cache).thumbnail(gtin, 180)
+        if thumbnail is None:
+            log.debug("No product image. Hiding image.")
+            return None
+        image_data = Image.open(io.BytesIO(thumbnail[1]))
+        image_data.load()
+        return image_data
+    except Exception as e:
+        log.warning("Error loading image: %s", e)
+        return None
 
 def generate_id(name, place, shelf):
     """Generate a unique ID based on name and location, ensuring at least one letter."""
@@ -78,13 +96,70 @@ def generate_id(name, place, shelf):
 
     return hashed
 
+class Completer:
+    """As-you-type completion of a Combobox from the store's suggest index.
+
+       The lookup runs on a worker thread once typing pauses for DELAY ms, so
+       the Tk thread never waits for it. All completions are offered in the
+       dropdown list, and the first one that starts with the typed text is
+       inserted selected behind the cursor: typing on replaces it, End accepts it."""
+
+    DELAY = 150  # ms
+
+    def __init__(self, app, combobox, field):
+        self.app = app
+        self.combobox = combobox
+        self.field = field
+        self._after = None
+        combobox.bind("<KeyRelease>", self.typed, add="+")
+
+    def typed(self, event):
+        """Start the lookup timer again after every typed character."""
+        if self._after is not None:
+            self.combobox.after_cancel(self._after)
+            self._after = None
+        # Deleting or moving the cursor does not complete
+        if event.char and event.char.isprintable() and self.app.store is not None:
+            self._after = self.combobox.after(self.DELAY, self.lookup)
+
+    def lookup(self):
+        self._after = None
+        text = self.combobox.get()
+        if text.strip() and self.combobox.index(tk.INSERT) == len(text):
+            self.app.run_in_background(self.app.store.suggest, lambda values: self.complete(text, values),
+                                       self.field, text)
+
+    def complete(self, text, values):
+        """Show the completions of `text`, unless the user typed on meanwhile."""
+        if self.combobox.get() != text:
+            return
+        self.combobox["values"] = values
+        for value in values:
+            if len(value) > len(text) and value.casefold().startswith(text.casefold()):
+                self.combobox.insert(tk.END, value[len(text):])
+                self.combobox.select_range(len(text), tk.END)
+                self.combobox.icursor(len(text))
+                break
+
 class IngredientApp:
     def __init__(self, root):
         self.root = root
-        self.root.title("Masala Dabba")
-        # Load database and schema at startup
-        self.ingredients = load_database()
-        self.schema = load_schema()
+        self.root.title("Masala Dabba (loading...)")
+        # Set by load_data() on a worker thread
+        self.store = None
+        self.validator = None
+        self.gtin_cache = None
+
+        # Network lookups and image decoding run on worker threads; their
+        # results are handed back to the Tk thread through this queue.
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="gui-worker")
+        self.results = queue.Queue()
+        self.lookup_generation = 0  # Increased for every GTIN lookup, older results are dropped
+        self.pending = []
+        self.root.after(50, self.process_results)
+        # The database and schema are loaded in the background; the dropdowns
+        # are filled in when they are ready (see data_loaded())
+        self.loaded = self.run_in_background(self.load_data, self.data_loaded, cancellable=False)
 
         # Define vegan and diet level options (showing number and description)
         self.vegan_options = [
@@ -127,13 +202,12 @@ class IngredientApp:
         self.gtin_button.grid(row=1, column=2, padx=5, pady=5)
 
         ttk.Label(basic_frame, text="Name:").grid(row=2, column=0, sticky=W, padx=5, pady=5)
-        self.name_entry = ttk.Entry(basic_frame)
+        self.name_entry = ttk.Combobox(basic_frame)
         self.name_entry.grid(row=2, column=1, padx=5, pady=5)
 
         ttk.Label(basic_frame, text="Category:").grid(row=3, column=0, sticky=W, padx=5, pady=5)
         self.category_var = tk.StringVar()
         self.category_combo = ttk.Combobox(basic_frame, textvariable=self.category_var, state=READONLY)
-        self.update_dropdown(self.category_combo, get_unique_dropdown_options(self.ingredients, "category"))
         self.category_combo.grid(row=3, column=1, padx=5, pady=5)
         self.category_add_btn = ttk.Button(basic_frame, text="+", width=2, bootstyle=(INFO, OUTLINE),
                                            command=lambda: self.add_new_option(self.category_combo))
@@ -142,7 +216,6 @@ class IngredientApp:
         ttk.Label(basic_frame, text="Source:").grid(row=4, column=0, sticky=W, padx=5, pady=5)
         self.source_var = tk.StringVar()
         self.source_combo = ttk.Combobox(basic_frame, textvariable=self.source_var, state=READONLY)
-        self.update_dropdown(self.source_combo, get_unique_dropdown_options(self.ingredients, "source"))
         self.source_combo.grid(row=4, column=1, padx=5, pady=5)
         self.source_add_btn = ttk.Button(basic_frame, text="+", width=2, bootstyle=(INFO, OUTLINE),
                                          command=lambda: self.add_new_option(self.source_combo))
@@ -164,7 +237,6 @@ class IngredientApp:
         # Place and Shelf on the same line
         self.place_var = tk.StringVar()
         self.place_combo = ttk.Combobox(location_frame, textvariable=self.place_var, state="readonly")
-        self.update_dropdown(self.place_combo, get_unique_dropdown_options(self.ingredients, "place"))
         self.place_combo.grid(row=0, column=1, padx=5, pady=5)
 
         # Add "+" button to add new places
@@ -303,12 +375,15 @@ class IngredientApp:
         clear_btn.grid(row=0, column=0, padx=5)
 
         # Submit Button
-        submit_btn = ttk.Button(button_frame, text="Submit", bootstyle="success", command=self.submit_entry)
-        submit_btn.grid(row=0, column=1, padx=5)
+        self.submit_btn = ttk.Button(button_frame, text="Submit", bootstyle="success", command=self.submit_entry,
+                                     state=DISABLED)
+        self.submit_btn.grid(row=0, column=1, padx=5)
 
 
         # --------------------- EVENT BINDINGS ----------------------
         self.name_entry.bind("<KeyRelease>", lambda event: self.update_id())
+        # Names (and synonyms) already in stock are completed while typing
+        self.name_completer = Completer(self, self.name_entry, "name")
         self.place_combo.bind("<KeyRelease>", lambda event: self.update_id())
         self.shelf_spin.bind("<FocusOut>", lambda event: self.update_id())  # Update when user clicks out
         self.shelf_spin.bind("<Return>", lambda event: self.update_id())  # Update when Enter is pressed
@@ -332,27 +407,94 @@ class IngredientApp:
     def test(self):
         pass
 
-    def display_image(self, url):
-        """Fetch and display product image from URL while maintaining aspect ratio."""
+    def run_in_background(self, func, callback, *args, cancellable=True):
+        """Run func(*args) on a worker thread and pass its result to callback on
+           the Tk thread. Cancellable work is dropped when a new GTIN is looked up."""
+        generation = self.lookup_generation if cancellable else None
+        future = self.executor.submit(func, *args)
+        future.add_done_callback(lambda f: self.results.put((generation, f, callback)))
+        if cancellable:
+            self.pending.append(future)
+        return future
+
+    def load_data(self):
+        """Open the database, schema and GTIN cache (runs on a worker thread).
+           Returns the values in use per dropdown field."""
+        with startup_step("import ingredient_store"):
+            from ingredient_store import get_store
+        with startup_step("import schema_validator (jsonschema)"):
+            from schema_validator import get_validator
+        with startup_step("import gtin_cache (requests)"):
+            from gtin_cache import get_gtin_cache
+        with startup_step("load ingredients"):
+            store = get_store(INGREDIENTS_FILE)
+            # Values in use per dropdown field, counted by the store
+            facets = store.facets()
+        with startup_step("compile schema"):
+            validator = get_validator(SCHEMA_FILE)
+            validator.preload()
+        with startup_step("open GTIN cache"):
+            # Same on-disk product cache as the web app's /gtin endpoint
+            self.gtin_cache = get_gtin_cache(GTIN_CACHE_FILE)
+        self.store, self.validator = store, validator
+        return facets
+
+    def data_loaded(self, facets):
+        """Fill the dropdowns once the database is loaded."""
+        with startup_step("fill dropdowns"):
+            self.update_dropdown(self.category_combo, get_dropdown_options(facets, "category"))
+            self.update_dropdown(self.source_combo, get_dropdown_options(facets, "source"))
+            self.update_dropdown(self.place_combo, get_dropdown_options(facets, "location.place"))
+            self.submit_btn.configure(state=NORMAL)
+            self.root.title("Masala Dabba")
+        self.root.event_generate("<<DataLoaded>>")
+        self.run_in_background(self.build_duplicate_index, lambda _: None, cancellable=False)
+
+    def build_duplicate_index(self):
+        """Build the duplicate index ahead of the first submit, which would
+           otherwise stall the window (runs on a worker thread)."""
         try:
-            response = requests.get(url, stream=True)
-            if response.status_code == 200:
-                image_data = Image.open(io.BytesIO(response.content))
-
-                # Define max width & height while maintaining aspect ratio
-                max_size = (180, 180)  # Max width and height
-                image_data.thumbnail(max_size, Image.Resampling.LANCZOS)  # Resize with aspect ratio
+            with startup_step("build duplicate index (numpy)"):
+                self.store.similar({"name": ""})
+        except Exception as e:
+            # Not fatal: the first submit tries again and reports the error
+            log.error("Could not build the duplicate index: %s", e)
+
+    def process_results(self):
+        """Deliver finished background work to its callback (polled on the Tk thread)."""
+        while True:
+            try:
+                generation, future, callback = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if future in self.pending:
+                self.pending.remove(future)
+            # Skip results of lookups that were superseded by a newer GTIN
+            if (generation is not None and generation != self.lookup_generation) or future.cancelled():
+                continue
+            if future.exception() and generation is None:
+                # The database could not be loaded at startup
+                messagebox.showerror("Error", f"Could not load the ingredients: {future.exception()}")
+                self.root.quit()
+            elif future.exception():
+                log.error("Background task failed: %s", future.exception())
+            else:
+                callback(future.result())
+        self.root.after(50, self.process_results)
 
-                self.image = ImageTk.PhotoImage(image_data)  # Keep a reference
+    def display_image(self, gtin):
+        """Fetch and display the product image of a GTIN while maintaining aspect ratio."""
+        self.run_in_background(load_image, self.show_image, self.gtin_cache, gtin)
 
-                self.image_label.config(image=self.image)  # Show image
-                self.image_label.grid()  # Make it visible
-            else:
-                print("Image could not be loaded (HTTP error). Hiding image.")  # Debugging
-                self.image_label.grid_remove()  # Hide on error
-        except Exception as e:
-            print(f"Error loading image: {e}")  # Debugging
-            self.image_label.grid_remove()  # Hide if an error occurs
+    def show_image(self, image_data):
+        """Show a loaded product image, or hide the image if it could not be loaded."""
+        if image_data is None:
+            self.image_label.grid_remove()  # Hide on error
+            return
+        from PIL import ImageTk
+        self.image = ImageTk.PhotoImage(image_data)  # Keep a reference
+        self.image_label.config(image=self.image)  # Show image
+        self.image_label.grid()  # Make it visible
 
     def format_spinbox_value(self, event):
         """Replace comma with dot in a spinbox value when focus is lost."""
@@ -362,103 +504,113 @@ class IngredientApp:
         widget.insert(0, value)  # Insert corrected value
 
     def fetch_gtin_data(self):
-        """Fetch and autofill ingredient details from GTIN."""
+        """Start looking up the GTIN in the background. A running lookup for a
+           previous GTIN is cancelled or its result ignored."""
         gtin = self.gtin_entry.get().strip()
         if gtin:
-            data = self.lookup_gtin(gtin)  # Calls the API lookup function
-            if data:
-                self.name_entry.delete(0, tk.END)
-                self.name_entry.insert(0, data["name"])
-
-                # Extract numeric part (size) and unit
-                size_text = data["size"]
-                match = re.match(r"([\d,.]+)\s*([a-zA-Z]*)", size_text)  # Extract number and unit
-
-                if match:
-                    size_value, unit_value = match.groups()
-                    size_value = size_value.replace(",", ".")  # Convert comma to dot
-                    self.size_value_spin.delete(0, tk.END)
-                    self.size_value_spin.insert(0, size_value)  # Store numeric size
-
-                    # Check if unit exists in the dropdown
-                    existing_units = self.unit_combo["values"]
-                    if unit_value in existing_units:
-                        self.unit_combo.set(unit_value)  # Select the unit
-                    else:
-                        messagebox.showwarning("Unknown Unit", f"The unit '{unit_value}' is not in the list.")
-
-                if not data["synonyms"] == "Unknown":
-                    self.synonyms_entry.delete(0, tk.END)
-                    self.synonyms_entry.insert(0, data["synonyms"])  # Fill in synonyms
-
-                self.allergenes_entry.delete(0, tk.END)
-                cleaned_allergens = [a.split(":")[-1] for a in data["allergenes"]]  # Remove country code
-                self.allergenes_entry.insert(0, ", ".join(cleaned_allergens))  # Display cleaned list
-
-                image_url = data.get("image_url", None)
-                print(f"GTIN Image URL: {image_url}")
-                if image_url:
-                    self.display_image(image_url)
+            self.lookup_generation += 1
+            for future in self.pending:
+                future.cancel()
+            self.run_in_background(self.lookup_gtin, self.fill_gtin_data, gtin)  # Calls the API lookup function
+
+    def fill_gtin_data(self, data):
+        """Autofill ingredient details from a GTIN lookup result."""
+        if data:
+            self.name_entry.delete(0, tk.END)
+            self.name_entry.insert(0, data["name"])
+
+            # Extract numeric part (size) and unit
+            size_text = data["size"]
+            match = re.match(r"([\d,.]+)\s*([a-zA-Z]*)", size_text)  # Extract number and unit
+
+            if match:
+                size_value, unit_value = match.groups()
+                size_value = size_value.replace(",", ".")  # Convert comma to dot
+                self.size_value_spin.delete(0, tk.END)
+                self.size_value_spin.insert(0, size_value)  # Store numeric size
+
+                # Check if unit exists in the dropdown
+                existing_units = self.unit_combo["values"]
+                if unit_value in existing_units:
+                    self.unit_combo.set(unit_value)  # Select the unit
                 else:
-                    self.image_label.grid_remove()
+                    messagebox.showwarning("Unknown Unit", f"The unit '{unit_value}' is not in the list.")
 
-                # Nutritional values
-                if "nutritional_values" in data:
-                    nutriments = data["nutritional_values"]
-                    self.energy_spin.delete(0, tk.END)
-                    self.energy_spin.insert(0, nutriments.get("energy-kcal_100g", 0))  # Energy
-                    self.energy_unit_combo.set(self.energy_predefined_units[0])
+            if not data["synonyms"] == "Unknown":
+                self.synonyms_entry.delete(0, tk.END)
+                self.synonyms_entry.insert(0, data["synonyms"])  # Fill in synonyms
 
-                    self.fat_total_spin.delete(0, tk.END)
-                    self.fat_total_spin.insert(0, nutriments.get("fat_100g", 0))  # Total fat
+            self.allergenes_entry.delete(0, tk.END)
+            cleaned_allergens = [a.split(":")[-1] for a in data["allergenes"]]  # Remove country code
+            self.allergenes_entry.insert(0, ", ".join(cleaned_allergens))  # Display cleaned list
 
-                    self.fat_sat_spin.delete(0, tk.END)
-                    self.fat_sat_spin.insert(0, nutriments.get("saturated-fat_100g", 0))  # Saturated fat
+            image_url = data.get("image_url", None)
+            log.debug("GTIN Image URL: %s", image_url)
+            if image_url:
+                self.display_image(data["gtin"])
+            else:
+                self.image_label.grid_remove()
 
-                    self.carb_total_spin.delete(0, tk.END)
-                    self.carb_total_spin.insert(0, nutriments.get("carbohydrates_100g", 0))  # Carbs
+            # Nutritional values
+            if "nutritional_values" in data:
+                nutriments = data["nutritional_values"]
+                self.energy_spin.delete(0, tk.END)
+                self.energy_spin.insert(0, nutriments.get("energy-kcal_100g", 0))  # Energy
+                self.energy_unit_combo.set(self.energy_predefined_units[0])
 
-                    self.sugar_spin.delete(0, tk.END)
-                    self.sugar_spin.insert(0, nutriments.get("sugars_100g", 0))  # Sugar
+                self.fat_total_spin.delete(0, tk.END)
+                self.fat_total_spin.insert(0, nutriments.get("fat_100g", 0))  # Total fat
 
-                    self.proteins_spin.delete(0, tk.END)
-                    self.proteins_spin.insert(0, nutriments.get("proteins_100g", 0))  # Protein
+                self.fat_sat_spin.delete(0, tk.END)
+                self.fat_sat_spin.insert(0, nutriments.get("saturated-fat_100g", 0))  # Saturated fat
 
-                    self.fiber_spin.delete(0, tk.END)
-                    self.fiber_spin.insert(0, nutriments.get("fiber_100g", 0))  # Fiber
+                self.carb_total_spin.delete(0, tk.END)
+                self.carb_total_spin.insert(0, nutriments.get("carbohydrates_100g", 0))  # Carbs
 
-                    self.salt_spin.delete(0, tk.END)
-                    self.salt_spin.insert(0, nutriments.get("salt_100g", 0))  # Salt
+                self.sugar_spin.delete(0, tk.END)
+                self.sugar_spin.insert(0, nutriments.get("sugars_100g", 0))  # Sugar
 
-                #messagebox.showinfo("GTIN Lookup", f"Product: {data['name']}\nBrand: {data['brand']}")
-                self.category_combo.focus()
-            else:
-                messagebox.showwarning("GTIN Lookup", "No data found for this GTIN.")
+                self.proteins_spin.delete(0, tk.END)
+                self.proteins_spin.insert(0, nutriments.get("proteins_100g", 0))  # Protein
+
+                self.fiber_spin.delete(0, tk.END)
+                self.fiber_spin.insert(0, nutriments.get("fiber_100g", 0))  # Fiber
+
+                self.salt_spin.delete(0, tk.END)
+                self.salt_spin.insert(0, nutriments.get("salt_100g", 0))  # Salt
+
+            #messagebox.showinfo("GTIN Lookup", f"Product: {data['name']}\nBrand: {data['brand']}")
+            self.category_combo.focus()
+        else:
+            messagebox.showwarning("GTIN Lookup", "No data found for this GTIN.")
 
     def lookup_gtin(self, gtin):
-        """Fetch product details using GTIN from Open Food Facts."""
-        url = f"https://de.openfoodfacts.org/api/v0/product/{gtin}"
-        response = requests.get(url)
-        
-        if response.status_code == 200:
-            data = response.json()
-            if "product" in data:
-                product = data["product"]
-
-                # Extract the best available image URL
-                image_url = product.get("image_url") or \
-                            product.get("image_front_url") or \
-                            product.get("image_small_url")
-            
-                return {
-                    "name": product.get("product_name", "Unknown"),
-                    "brand": product.get("brands", "Unknown"),
-                    "size": product.get("quantity", "Unknown"),  # Size of the product
-                    "synonyms": product.get("generic_name", "Unknown"),  # Alternative names
-                    "allergenes": product.get("allergens_tags", []),  # List of allergens
-                    "nutritional_values": product.get("nutriments", {}),  # Nutritional information
-                    "image_url": image_url
-                }
+        """Fetch product details using GTIN from Open Food Facts (cached on disk)."""
+        import requests
+        # Lookups right after the start wait for the GTIN cache to be opened
+        self.loaded.result()
+        try:
+            product = self.gtin_cache.lookup(gtin)
+        except requests.RequestException as e:
+            log.warning("GTIN lookup failed: %s", e)
+            return None
+
+        if product:
+            # Extract the best available image URL
+            image_url = product.get("image_url") or \
+                        product.get("image_front_url") or \
+                        product.get("image_small_url")
+
+            return {
+                "gtin": gtin,
+                "name": product.get("product_name", "Unknown"),
+                "brand": product.get("brands", "Unknown"),
+                "size": product.get("quantity", "Unknown"),  # Size of the product
+                "synonyms": product.get("generic_name", "Unknown"),  # Alternative names
+                "allergenes": product.get("allergens_tags", []),  # List of allergens
+                "nutritional_values": product.get("nutriments", {}),  # Nutritional information
+                "image_url": image_url
+            }
         return None  # Return None if GTIN not found
 
     def update_id(self):
@@ -549,18 +701,32 @@ class IngredientApp:
         entry["price"] = float(self.price_spin.get())
         entry["comment"] = self.comment_entry.get().strip()
 
+        from jsonschema import ValidationError
         try:
-            jsonschema.validate(instance=entry, schema=self.schema)
-        except jsonschema.ValidationError as e:
+            self.validator.validate(entry)
+        except ValidationError as e:
             messagebox.showerror("Validation Error", f"Data validation error: {e.message}")
             return
 
-        self.ingredients.append(entry)
-        save_database(self.ingredients)
+        similar = self.store.similar(entry)
+        if similar:
+            lines = []
+            for ingredient, similarity in similar[:5]:
+                location = ingredient.get("location", {})
+                where = ", ".join(str(v) for v in (location.get("place"), location.get("shelf")) if v)
+                lines.append(f"- {ingredient['name']} ({where}), {similarity:.0%} similar")
+            if not messagebox.askyesno("Possible Duplicate",
+                                       "Similar ingredients already exist:\n" + "\n".join(lines) + "\n\nAdd it anyway?"):
+                return
+
+        if not self.store.add(entry):
+            messagebox.showerror("Error", "An ingredient with this ID already exists.")
+            return
+        facets = self.store.facets()
         messagebox.showinfo("Success", "Ingredient added successfully!")
-        self.update_dropdown(self.unit_combo, get_unique_dropdown_options(self.ingredients, "unit"))
-        self.update_dropdown(self.source_combo, get_unique_dropdown_options(self.ingredients, "source"))
-        self.update_dropdown(self.category_combo, get_unique_dropdown_options(self.ingredients, "category"))
+        self.update_dropdown(self.unit_combo, get_dropdown_options(facets, "size.unit"))
+        self.update_dropdown(self.source_combo, get_dropdown_options(facets, "source"))
+        self.update_dropdown(self.category_combo, get_dropdown_options(facets, "category"))
         self.clear_form()
 
     def clear_form(self):
@@ -612,9 +778,27 @@ def create_gui():
     return root, app
 
 def main():
+    parser = argparse.ArgumentParser(description="Masala Dabba: add ingredients to the kitchen database.")
+    parser.add_argument("--startup-timing", action="store_true",
+                        help="print how long each startup step took and quit once everything is loaded")
+    args = parser.parse_args()
+    # DABBA_LOG_LEVEL=DEBUG shows the debugging messages
+    logging.basicConfig(level=os.environ.get("DABBA_LOG_LEVEL", "WARNING").upper(),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
     ensure_files_exist()
-    root, app = create_gui()
+    with startup_step("create window"):
+        root, app = create_gui()
+    if args.startup_timing:
+        # Quit once the dropdowns were filled in
+        root.bind("<<DataLoaded>>", lambda event: root.quit())
+    with startup_step("show window"):
+        root.update()
     root.mainloop()
+    if args.startup_timing:
+        print_startup_times()
+    app.executor.shutdown(wait=False, cancel_futures=True)
+    if app.store is not None:
+        app.store.close()
 
 if __name__ == "__main__":
     main()
@@ -1,13 +1,85 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, g, make_response, render_template, request, jsonify
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import is_resource_modified
+from datetime import date, datetime, timedelta, timezone
+import cProfile
+import functools
+import gzip
+import io
 import json
+import math
 import os
+import pstats
+import re
+import requests
+import time
+from jsonschema import ValidationError
+from ingredient_store import ConflictError, get_store, paginate, project, record_etag, FILTER_FIELDS, SORT_FIELDS
+from schema_validator import get_validator
+from ingredient_io import read_jsonl, iter_csv, iter_jsonl
+from gtin_cache import get_gtin_cache, is_gtin
+from image_cache import get_image_cache
+from facet_index import FACET_FIELDS
+from column_index import GROUP_FIELDS, STAT_FIELDS
+from suggest_index import SUGGEST_FIELDS
+import metrics
+import serializer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+REQUEST_SECONDS = metrics.Histogram("dabba_request_duration_seconds", "Time to handle a request.",
+                                    ["endpoint", "method"])
+REQUESTS = metrics.Counter("dabba_requests_total", "Handled requests.", ["endpoint", "method", "status"])
+JSON_ENCODE_SECONDS = metrics.Histogram("dabba_json_encode_seconds", "Time to serialize a JSON response.")
+
+# JSON provider that serializes responses compactly with serializer.dumps
+# (orjson if installed) and measures how long that takes
+class FastJSONProvider(DefaultJSONProvider):
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        with JSON_ENCODE_SECONDS.time():
+            data = serializer.dumps(obj, sort_keys=self.sort_keys, default=self.default)
+        return self._app.response_class(data + b"\n", mimetype=self.mimetype)
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 
 # File paths
 JSON_DIR = "Json"
 INGREDIENTS_FILE = os.path.join(JSON_DIR, "Ingredients.json")
 SCHEMA_FILE = os.path.join(JSON_DIR, "Ingredient_Schema.json")
+GTIN_CACHE_FILE = os.path.join(JSON_DIR, "gtin_cache.db")
+IMAGE_CACHE_DIR = os.path.join(JSON_DIR, "images")
+
+# Content types accepted as JSONL by POST /ingredients/bulk
+JSONL_MIMETYPES = ("application/x-ndjson", "application/jsonl", "application/x-jsonlines")
+
+# Seconds a long-poll request to /ingredients/changes waits at most, and
+# between two keep-alive comments on the event stream
+CHANGES_MAX_WAIT = 60
+CHANGES_KEEPALIVE = 15
+
+# Largest accepted limit and offset of list endpoints, and magnitude of the
+# min_vegan and max_diet filters (SQLite and orjson handle 64 bit integers)
+MAX_LIST_PARAM = 2**63 - 1
+
+# Maximum number of completions /ingredients/suggest returns
+SUGGEST_MAX_LIMIT = 50
+
+# Responses of these types and at least this size (bytes) are compressed
+COMPRESS_MIMETYPES = ("application/json", "application/x-ndjson", "text/html", "text/plain", "text/csv")
+COMPRESS_MIN_SIZE = 500
+
+# Seconds browsers may keep product image thumbnails without asking again
+IMAGE_MAX_AGE = 30 * 24 * 3600
+
+# With DABBA_PROFILE=1 a request with the header "X-Profile: 1" returns the
+# PROFILE_LINES most expensive functions (cumulative time) instead of the response
+PROFILE = os.environ.get("DABBA_PROFILE") == "1"
+PROFILE_LINES = 30
 
 # Hardcoded password for security (later, move this to an environment variable)
 ADMIN_PASSWORD = "Dabba!"
@@ -17,33 +89,186 @@ os.makedirs(JSON_DIR, exist_ok=True)
 
 #------------------ FUNCTIONS -----------------------------
 
-# Load ingredients database
-def load_database():
-    if not os.path.exists(INGREDIENTS_FILE):
-        return []
-    with open(INGREDIENTS_FILE, "r") as f:
-        return json.load(f)
-
-# Save ingredients database
-def save_database(data):
-    with open(INGREDIENTS_FILE, "w") as f:
-        json.dump(data, f, indent=4)
+# Shared in-memory ingredients database (reloaded only when the file changes)
+store = get_store(INGREDIENTS_FILE)
+validator = get_validator(SCHEMA_FILE)
+# Open Food Facts products, cached on disk
+gtin_cache = get_gtin_cache(GTIN_CACHE_FILE)
+# Product image thumbnails, cached on disk
+image_cache = get_image_cache(IMAGE_CACHE_DIR, gtin_cache)
 
-# Load schema
-def load_schema():
-    with open(SCHEMA_FILE, "r") as f:
-        return json.load(f)
+metrics.Gauge("dabba_database_bytes", "Size of the database files.", lambda: store.disk_usage())
+metrics.Gauge("dabba_ingredients", "Number of ingredients.", lambda: store.query(limit=0)[0])
 
-# Validate ingredient against schema
+# Validate ingredient against schema (compiled once, reloaded when the file changes)
 def validate_ingredient(data):
-    schema = load_schema()
-    from jsonschema import validate, ValidationError
     try:
-        validate(instance=data, schema=schema)
+        validator.validate(data)
         return None
     except ValidationError as e:
         return str(e)
-    
+
+# Read limit, offset, sort and fields query parameters of list endpoints
+def list_params():
+    try:
+        limit = int(request.args["limit"]) if "limit" in request.args else None
+        offset = int(request.args.get("offset", 0))
+    except ValueError:
+        raise ValueError("'limit' and 'offset' must be integers")
+    if (limit is not None and limit < 0) or offset < 0:
+        raise ValueError("'limit' and 'offset' must not be negative")
+    if (limit is not None and limit > MAX_LIST_PARAM) or offset > MAX_LIST_PARAM:
+        raise ValueError(f"'limit' and 'offset' must be at most {MAX_LIST_PARAM}")
+    sort = request.args.get("sort") or None
+    if sort and sort.lstrip("-") not in SORT_FIELDS:
+        raise ValueError(f"'sort' must be one of: {', '.join(SORT_FIELDS)}")
+    fields = [f.strip() for f in request.args.get("fields", "").split(",") if f.strip()]
+    return limit, offset, sort, fields
+
+# Parse a period like "7d", "2w" or "7" (days) into a timedelta
+def parse_period(value):
+    match = re.fullmatch(r"(\d+)([dw]?)", value.strip())
+    if not match:
+        raise ValueError("'within' must be a number of days, e.g. 7d or 2w")
+    days = int(match.group(1))
+    try:
+        return timedelta(weeks=days) if match.group(2) == "w" else timedelta(days=days)
+    except OverflowError:
+        raise ValueError("'within' is too long")
+
+# Read the "safe for this guest" filters of GET /ingredients
+def guest_filters():
+    filters = {}
+    for key in ("exclude_allergens", "exclude_distaste"):
+        if key in request.args:
+            filters[key] = [v.strip() for v in request.args[key].split(",") if v.strip()]
+    for key in ("min_vegan", "max_diet"):
+        if key in request.args:
+            try:
+                filters[key] = int(request.args[key])
+            except ValueError:
+                raise ValueError(f"'{key}' must be an integer")
+            if abs(filters[key]) > MAX_LIST_PARAM:
+                raise ValueError(f"'{key}' must be between {-MAX_LIST_PARAM} and {MAX_LIST_PARAM}")
+    return filters
+
+# Build the response of a list endpoint. A plain list is returned unless
+# limit or offset was given; then the page is wrapped together with the total.
+# Whole ingredients are joined from the store's pre-encoded JSON.
+def list_response(total, ingredients, limit, offset, fields):
+    with JSON_ENCODE_SECONDS.time():
+        if fields:
+            data = serializer.dumps([project(ing, fields) for ing in ingredients])
+        else:
+            data = store.encode(ingredients)
+        if "limit" in request.args or "offset" in request.args:
+            page = serializer.dumps({"total": total, "offset": offset, "limit": limit})
+            data = page[:-1] + b',"items":' + data + b"}"
+    return Response(data + b"\n", mimetype="application/json")
+
+# Response with a single ingredient, tagged with its version for If-Match
+def ingredient_response(ingredient, status=200):
+    response = jsonify(ingredient)
+    response.status_code = status
+    response.set_etag(record_etag(ingredient))
+    return response
+
+# Short description of a probable duplicate, enough to recognize it
+def duplicate_summary(ingredient, similarity=None):
+    summary = {"id": ingredient["id"], "name": ingredient.get("name"), "location": ingredient.get("location")}
+    if similarity is not None:
+        summary["similarity"] = round(similarity, 3)
+    return summary
+
+# Decorator for views whose response only depends on the URL and the data.
+# Adds a weak ETag and Last-Modified from the database version and answers
+# 304 without running the view when the client's copy is still current.
+def conditional_on_version(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        version, modified = store.version()
+        modified = datetime.fromtimestamp(modified, timezone.utc)
+        if is_resource_modified(request.environ, etag=version, last_modified=modified):
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        else:
+            response = Response(status=304)
+        response.set_etag(version, weak=True)
+        response.last_modified = modified
+        # Let browsers cache the response, but always revalidate it
+        response.cache_control.no_cache = True
+        return response
+    return wrapper
+
+# ETags of the If-Match header, or None if the client sent none (or "*")
+def if_match_etags():
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    return request.if_match.as_set(include_weak=True)
+
+# Server-Sent Events for a result of store.changes(): the events, a reset if
+# they are not known anymore, or a keep-alive comment if there are none
+def change_stream_text(cursor, events):
+    if events is None:
+        return f"id: {cursor}\nevent: reset\ndata: {{}}\n\n"
+    if not events:
+        return ": keep-alive\n\n"
+    epoch = cursor.rsplit(":", 1)[0]
+    return "".join(f"id: {epoch}:{event['seq']}\nevent: {event['op']}\ndata: {json.dumps(event)}\n\n"
+                   for event in events)
+
+# The rule of the matched route (e.g. /ingredients/<id>) keeps the number of
+# label values small; requests for unknown URLs share one label.
+def endpoint_label():
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if PROFILE and request.headers.get("X-Profile") == "1":
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+# Registered before compress_response, so it runs after it (and times it)
+@app.after_request
+def record_request(response):
+    profiler = g.pop("profiler", None)
+    if profiler:
+        profiler.disable()
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(PROFILE_LINES)
+        response = Response(output.getvalue(), mimetype="text/plain")
+    start = g.pop("request_start", None)
+    if start is not None:
+        endpoint = endpoint_label()
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint, request.method)
+        REQUESTS.inc(endpoint, request.method, response.status_code)
+    return response
+
+# Compress responses with brotli (if installed) or gzip, as the client accepts
+@app.after_request
+def compress_response(response):
+    if response.mimetype not in COMPRESS_MIMETYPES or response.direct_passthrough or response.is_streamed:
+        return response
+    response.vary.add("Accept-Encoding")
+    if (response.status_code != 200 or "Content-Encoding" in response.headers
+            or response.content_length is None or response.content_length < COMPRESS_MIN_SIZE):
+        return response
+    if brotli and request.accept_encodings["br"]:
+        response.set_data(brotli.compress(response.get_data(), quality=5))
+        response.headers["Content-Encoding"] = "br"
+    elif request.accept_encodings["gzip"]:
+        response.set_data(gzip.compress(response.get_data(), compresslevel=6))
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        return response
+    # The compressed body is a different representation
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
 #--------------------- ENDPOINTS -----------------------------
 
 @app.route("/")
@@ -66,8 +291,7 @@ def about():
 @app.route("/ingredient/details/<id>")
 def ingredient_details(id):
     """Retrieve ingredient details and render the ingredient details page."""
-    ingredients = load_database()
-    ingredient = next((ing for ing in ingredients if ing["id"] == id), None)
+    ingredient = store.get(id)
 
     if not ingredient:
         return "Ingredient not found", 404
@@ -75,21 +299,40 @@ def ingredient_details(id):
     return render_template("ingredient_overview.html", ingredient=ingredient)
 
 @app.route("/ingredients", methods=["GET"])
+@conditional_on_version
 def get_all_ingredients():
-    """Retrieve all ingredients."""
-    return jsonify(load_database())
+    """Retrieve all ingredients, optionally filtered by place, category, source,
+       vegan_level, diet_level or allergene. "Safe for this guest" filters:
+       exclude_allergens and exclude_distaste (comma separated), min_vegan and
+       max_diet. Supports limit/offset pagination, sort=<field> (or -<field>)
+       and fields=<comma separated list>."""
+    try:
+        limit, offset, sort, fields = list_params()
+        guest = guest_filters()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    filters = {key: request.args[key] for key in FILTER_FIELDS if key in request.args}
+    filters.update(guest)
+    total, ingredients = store.query(filters, sort, limit, offset)
+    return list_response(total, ingredients, limit, offset, fields)
 
 @app.route("/ingredients/<id>", methods=["GET"])
 def get_ingredient(id):
-    """Retrieve a single ingredient by ID."""
-    ingredients = load_database()
-    ingredient = next((ing for ing in ingredients if ing["id"] == id), None)
-    return jsonify(ingredient) if ingredient else ("Ingredient not found", 404)
+    """Retrieve a single ingredient by ID. The ETag header holds its version,
+       to be sent back as If-Match when updating or deleting it."""
+    modified = store.version()[1]
+    ingredient = store.get(id)
+    if not ingredient:
+        return "Ingredient not found", 404
+    response = ingredient_response(ingredient)
+    response.last_modified = datetime.fromtimestamp(modified, timezone.utc)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 @app.route("/ingredients", methods=["POST"])
 def add_ingredient():
     """Add a new ingredient."""
-    ingredients = load_database()
     new_ingredient = request.json
 
     # Validate ingredient
@@ -97,21 +340,197 @@ def add_ingredient():
     if validation_error:
         return jsonify({"error": validation_error}), 400
 
-    # Check if ID already exists
-    if any(ing["id"] == new_ingredient["id"] for ing in ingredients):
+    # Ask before adding a probable duplicate, unless force=1
+    if request.args.get("force") not in ("1", "true"):
+        similar = store.similar(new_ingredient)
+        if similar:
+            return jsonify({
+                "error": "Probable duplicate of existing ingredients; repeat with force=1 to add it anyway",
+                "duplicates": [duplicate_summary(ing, similarity) for ing, similarity in similar],
+            }), 409
+
+    # Add unless the ID already exists
+    if not store.add(new_ingredient):
         return jsonify({"error": "Ingredient with this ID already exists"}), 400
 
-    ingredients.append(new_ingredient)
-    save_database(ingredients)
-    return jsonify(new_ingredient), 201
+    return ingredient_response(new_ingredient, 201)
+
+@app.route("/ingredients/bulk", methods=["POST"])
+def add_ingredients_bulk():
+    """Add many ingredients at once, from a JSON array or a streamed JSONL body
+       (Content-Type application/x-ndjson). All valid ingredients are saved in
+       a single write; the others are reported per record."""
+    if request.mimetype in JSONL_MIMETYPES:
+        records = read_jsonl(request.stream)
+    else:
+        data = request.get_json(silent=True)
+        if not isinstance(data, list):
+            return jsonify({"error": "Expected a JSON array or a JSONL body"}), 400
+        records = ((number, ingredient, None) for number, ingredient in enumerate(data, start=1))
+
+    accepted, errors, seen = [], [], set()
+    for number, ingredient, error in records:
+        if error is None:
+            error = validate_ingredient(ingredient)
+        if error is None and ingredient["id"] in seen:
+            error = "Duplicate ID in this request"
+        if error:
+            id = ingredient.get("id") if isinstance(ingredient, dict) else None
+            errors.append({"record": number, "id": id, "error": error})
+            continue
+        seen.add(ingredient["id"])
+        accepted.append((number, ingredient))
+
+    skipped = set(store.add_many([ingredient for _, ingredient in accepted]))
+    for number, ingredient in accepted:
+        if ingredient["id"] in skipped:
+            errors.append({"record": number, "id": ingredient["id"], "error": "Ingredient with this ID already exists"})
+    errors.sort(key=lambda error: error["record"])
+
+    added = len(accepted) - len(skipped)
+    return jsonify({"added": added, "errors": errors}), 201 if added else 400
+
+@app.route("/ingredients/export", methods=["GET"])
+def export_ingredients():
+    """Stream all ingredients as JSONL (default) or CSV (?format=csv)."""
+    format = request.args.get("format", "jsonl")
+    if format == "jsonl":
+        return Response(iter_jsonl(store.iter_all()), mimetype="application/x-ndjson",
+                        headers={"Content-Disposition": "attachment; filename=ingredients.jsonl"})
+    if format == "csv":
+        return Response(iter_csv(store.iter_all()), mimetype="text/csv",
+                        headers={"Content-Disposition": "attachment; filename=ingredients.csv"})
+    return jsonify({"error": "'format' must be jsonl or csv"}), 400
+
+@app.route("/ingredients/facets", methods=["GET"])
+@conditional_on_version
+def ingredient_facets():
+    """Number of ingredients per category, place, shelf, unit, source, allergene
+       and storage condition, for dropdowns. fields=<comma separated list>
+       selects some of the facets."""
+    names = [f.strip() for f in request.args.get("fields", "").split(",") if f.strip()]
+    unknown = [name for name in names if name not in FACET_FIELDS]
+    if unknown:
+        return jsonify({"error": f"'fields' must be some of: {', '.join(FACET_FIELDS)}"}), 400
+    return jsonify(store.facets(names))
+
+@app.route("/ingredients/suggest", methods=["GET"])
+@conditional_on_version
+def suggest_ingredients():
+    """Completions for the add form: values of field=name (names and
+       synonyms, the default), place or source with a word starting with
+       prefix, ignoring case and accents. limit (default 10) caps the list."""
+    field = request.args.get("field", "name")
+    if field not in SUGGEST_FIELDS:
+        return jsonify({"error": f"'field' must be one of: {', '.join(SUGGEST_FIELDS)}"}), 400
+    try:
+        limit = int(request.args.get("limit", 10))
+    except ValueError:
+        return jsonify({"error": "'limit' must be an integer"}), 400
+    if not 0 < limit <= SUGGEST_MAX_LIMIT:
+        return jsonify({"error": f"'limit' must be between 1 and {SUGGEST_MAX_LIMIT}"}), 400
+    return jsonify(store.suggest(field, request.args.get("prefix", ""), limit))
+
+@app.route("/ingredients/duplicates", methods=["GET"])
+@conditional_on_version
+def duplicate_ingredients():
+    """Groups of probable duplicates (similar names and synonyms), most similar
+       first. threshold (0-1, default 0.6) is the trigram similarity from which
+       two ingredients count as duplicates."""
+    try:
+        threshold = float(request.args["threshold"]) if "threshold" in request.args else None
+    except ValueError:
+        return jsonify({"error": "'threshold' must be a number"}), 400
+    if threshold is not None and not 0 < threshold <= 1:
+        return jsonify({"error": "'threshold' must be between 0 and 1"}), 400
+    return jsonify([{"similarity": round(similarity, 3),
+                     "ingredients": [duplicate_summary(ing) for ing in ingredients]}
+                    for ingredients, similarity in store.duplicates(threshold)])
+
+@app.route("/ingredients/stats", methods=["GET"])
+@conditional_on_version
+def ingredient_stats():
+    """Count, sum, mean, min and max of price, size and nutritional values.
+       fields=<comma separated list> selects the values, group_by=category,
+       place, source, vegan_level or diet_level groups them, and the
+       ingredients can be filtered by the same keys (e.g. ?place=Keller)."""
+    fields = [f.strip() for f in request.args.get("fields", "").split(",") if f.strip()]
+    if any(field not in STAT_FIELDS for field in fields):
+        return jsonify({"error": f"'fields' must be some of: {', '.join(STAT_FIELDS)}"}), 400
+    group_by = request.args.get("group_by") or None
+    if group_by and group_by not in GROUP_FIELDS:
+        return jsonify({"error": f"'group_by' must be one of: {', '.join(GROUP_FIELDS)}"}), 400
+
+    filters = {key: request.args[key] for key in GROUP_FIELDS if key in request.args}
+    return jsonify(store.stats(fields, group_by, filters))
+
+@app.route("/ingredients/expiring", methods=["GET"])
+def expiring_ingredients():
+    """Ingredients whose best before date is within the given period from today
+       (within=7d, 2w or a number of days; default 7d), soonest first. With
+       expired=1 already expired ingredients are included. Can be filtered by
+       place and category and accepts limit, offset, sort and fields."""
+    today = date.today()
+    try:
+        within = parse_period(request.args.get("within", "7d"))
+        limit, offset, sort, fields = list_params()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        end = today + within
+    except OverflowError:
+        return jsonify({"error": "'within' is too long"}), 400
+
+    start = None if request.args.get("expired") in ("1", "true") else today
+    filters = {key: request.args[key] for key in ("place", "category") if key in request.args}
+    total, results = paginate(store.expiring(start, end, filters), sort, limit, offset)
+    return list_response(total, results, limit, offset, fields)
+
+@app.route("/ingredients/changes", methods=["GET"])
+def ingredient_changes():
+    """Feed of add/update/delete events, each with a sequence number, for
+       keeping a local copy up to date (also after writes by the GUI).
+
+       With "Accept: text/event-stream" the events are streamed as Server-Sent
+       Events, resuming after the Last-Event-ID header or ?since=<cursor>.
+       Otherwise this is a long poll: waits up to ?wait=<seconds> for changes
+       after ?since and returns {"cursor", "events"}. Without since only the
+       current cursor is returned. If the changes since the cursor are not
+       known anymore, "reset" tells the client to reload everything."""
+    since = request.headers.get("Last-Event-ID") or request.args.get("since") or None
+
+    if request.accept_mimetypes.best == "text/event-stream":
+        def stream():
+            cursor, _ = store.changes()
+            resume = since
+            if resume is None:
+                yield f"id: {cursor}\nevent: ready\ndata: {{}}\n\n"
+                resume = cursor
+            while True:
+                cursor, events = store.changes(resume, timeout=CHANGES_KEEPALIVE)
+                yield change_stream_text(cursor, events)
+                resume = cursor
+        return Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    try:
+        wait = float(request.args.get("wait", 0))
+        if not math.isfinite(wait):
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": "'wait' must be a number of seconds"}), 400
+    wait = min(wait, CHANGES_MAX_WAIT)
+    cursor, events = store.changes(since, timeout=max(wait, 0) if since else 0)
+    if events is None:
+        return jsonify({"cursor": cursor, "reset": True, "events": []})
+    return jsonify({"cursor": cursor, "reset": False, "events": events})
 
 @app.route("/ingredients/<id>", methods=["PUT"])
 def update_ingredient(id):
-    """Update an existing ingredient (requires password)."""
+    """Update an existing ingredient (requires password). With an If-Match
+       header the update fails with 409 if the ingredient changed since."""
     if request.headers.get("Authorization") != ADMIN_PASSWORD:
         return jsonify({"error": "Unauthorized"}), 403
 
-    ingredients = load_database()
     updated_ingredient = request.json
 
     # Validate ingredient
@@ -119,37 +538,89 @@ def update_ingredient(id):
     if validation_error:
         return jsonify({"error": validation_error}), 400
 
-    for i, ingredient in enumerate(ingredients):
-        if ingredient["id"] == id:
-            ingredients[i] = updated_ingredient
-            save_database(ingredients)
-            return jsonify(updated_ingredient)
+    try:
+        updated = store.update(id, updated_ingredient, if_match_etags())
+    except ConflictError as e:
+        return jsonify({"error": str(e)}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if updated:
+        return ingredient_response(updated_ingredient)
 
     return jsonify({"error": "Ingredient not found"}), 404
 
 @app.route("/ingredients/<id>", methods=["DELETE"])
 def delete_ingredient(id):
-    """Delete an ingredient (requires password)."""
+    """Delete an ingredient (requires password). With an If-Match header the
+       delete fails with 409 if the ingredient changed since."""
     if request.headers.get("Authorization") != ADMIN_PASSWORD:
         return jsonify({"error": "Unauthorized"}), 403
 
-    ingredients = load_database()
-    ingredients = [ing for ing in ingredients if ing["id"] != id]
+    try:
+        deleted = store.delete(id, if_match_etags())
+    except ConflictError as e:
+        return jsonify({"error": str(e)}), 409
+    if not deleted:
+        return jsonify({"error": "Ingredient not found"}), 404
 
-    save_database(ingredients)
     return jsonify({"message": "Ingredient deleted"}), 200
 
 @app.route("/ingredients/search", methods=["GET"])
+@conditional_on_version
 def search_ingredients():
-    """Search for ingredients by name, category, or other fields."""
+    """Search for ingredients by name, category, or other fields.
+       Accepts the same limit, offset, sort and fields parameters as /ingredients."""
     query = request.args.get("q", "").lower()
     if not query:
         return jsonify({"error": "Query parameter 'q' is required"}), 400
-
-    ingredients = load_database()
-    results = [ing for ing in ingredients if query in ing["name"].lower() or query in ing["category"].lower()]
-    
-    return jsonify(results)
+    try:
+        limit, offset, sort, fields = list_params()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    total, results = paginate(store.search(query), sort, limit, offset)
+    return list_response(total, results, limit, offset, fields)
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/gtin/<code>", methods=["GET"])
+def gtin_lookup(code):
+    """Look up a product by GTIN. Answers like the Open Food Facts API
+       ({"status": 1, "product": ...}) but from the local cache when possible."""
+    if not is_gtin(code):
+        return jsonify({"status": 0, "error": "Invalid GTIN"}), 400
+    try:
+        product = gtin_cache.lookup(code)
+    except requests.RequestException:
+        return jsonify({"status": 0, "error": "Open Food Facts is not reachable"}), 503
+    if product is None:
+        return jsonify({"status": 0, "error": "Product not found"}), 404
+    return jsonify({"status": 1, "product": product})
+
+@app.route("/images/<gtin>", methods=["GET"])
+def product_image(gtin):
+    """Product image of a GTIN as a WebP thumbnail that fits size x size pixels
+       (rounded up to one of 90, 180, 360 or 720; default 180)."""
+    if not is_gtin(gtin):
+        return jsonify({"error": "Invalid GTIN"}), 400
+    try:
+        size = int(request.args.get("size", 180))
+    except ValueError:
+        return jsonify({"error": "'size' must be an integer"}), 400
+    try:
+        thumbnail = image_cache.thumbnail(gtin, size)
+    except requests.RequestException:
+        return jsonify({"error": "Open Food Facts is not reachable"}), 503
+    if thumbnail is None:
+        return jsonify({"error": "No image found"}), 404
+    digest, data = thumbnail
+    response = Response(data, mimetype="image/webp")
+    response.set_etag(f"{digest}-{size}")
+    response.cache_control.public = True
+    response.cache_control.max_age = IMAGE_MAX_AGE
+    return response.make_conditional(request)
 
 if __name__ == "__main__":
     app.run(debug=True)
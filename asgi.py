@@ -0,0 +1,394 @@
+import asyncio
+import logging
+import math
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+from urllib.parse import parse_qs, parse_qsl, urlencode
+
+import httpx
+import requests
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from app import (app as flask_app, change_stream_text, gtin_cache, image_cache, store,
+                 CHANGES_KEEPALIVE, CHANGES_MAX_WAIT, REQUEST_SECONDS, REQUESTS)
+from gtin_cache import OFF_URL, parse_product
+
+log = logging.getLogger(__name__)
+
+# Worker threads for the Flask views
+THREADS = int(os.environ.get("DABBA_ASGI_THREADS", 100))
+# Connections to Open Food Facts at most; further requests wait for a free one
+UPSTREAM_CONNECTIONS = int(os.environ.get("DABBA_UPSTREAM_CONNECTIONS", 20))
+# Seconds to wait for a product and for an image once connected, and for a
+# free connection
+PRODUCT_TIMEOUT = 5
+IMAGE_TIMEOUT = 10
+UPSTREAM_QUEUE_TIMEOUT = 30
+
+# Request bodies up to this size (bytes) are kept in memory
+BODY_MEMORY_SIZE = 1024 * 1024
+
+CHANGES_PATH = "/ingredients/changes"
+# Seconds the thread watching the store for the change feed waits at a time
+CHANGES_POLL = 1
+
+GTIN_PATH = re.compile(r"/gtin/([0-9]{8,14})")
+IMAGE_PATH = re.compile(r"/images/([0-9]{8,14})")
+
+#------------------ WSGI BRIDGE -----------------------------
+
+def wsgi_environ(scope, body):
+    """Return the WSGI environ of an ASGI HTTP request."""
+    root_path = scope.get("root_path", "")
+    path = scope["path"]
+    if path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root_path.encode("utf-8").decode("latin-1"),
+        "PATH_INFO": path.encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1] or 80),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = "HTTP_" + name
+        value = value.decode("latin-1")
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    return environ
+
+class WSGIBridge:
+    """Runs a WSGI application for ASGI HTTP requests in a thread pool.
+
+       The response is sent chunk by chunk as the application produces it
+       (event streams included); once the client disconnects, the
+       application's iterator is closed."""
+
+    def __init__(self, wsgi_app, threads=THREADS):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="wsgi")
+
+    async def __call__(self, scope, receive, send):
+        body = SpooledTemporaryFile(max_size=BODY_MEMORY_SIZE)
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                body.close()
+                return
+            body.write(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        body.seek(0)
+
+        disconnected = threading.Event()
+
+        async def watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+
+        watcher = asyncio.ensure_future(watch_disconnect())
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self.executor, self.run, scope, body, send, loop, disconnected)
+        finally:
+            watcher.cancel()
+            body.close()
+
+    def run(self, scope, body, send, loop, disconnected):
+        """Call the application and send its response (in a worker thread)."""
+        def send_message(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        start = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and start.get("sent"):
+                raise exc_info[1].with_traceback(exc_info[2])
+            start["message"] = {
+                "type": "http.response.start",
+                "status": int(status.split(" ", 1)[0]),
+                "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+            }
+
+        def send_start():
+            if not start.get("sent"):
+                send_message(start["message"])
+                start["sent"] = True
+
+        result = self.wsgi_app(wsgi_environ(scope, body), start_response)
+        try:
+            for chunk in result:
+                if disconnected.is_set():
+                    return
+                if chunk:
+                    send_start()
+                    send_message({"type": "http.response.body", "body": chunk, "more_body": True})
+            send_start()
+            send_message({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+#------------------ UPSTREAM -----------------------------
+
+class Upstream:
+    """Pooled async HTTP client for Open Food Facts, limited to
+       UPSTREAM_CONNECTIONS connections. Concurrent requests for the same
+       product or image share one download."""
+
+    def __init__(self):
+        limits = httpx.Limits(max_connections=UPSTREAM_CONNECTIONS, max_keepalive_connections=UPSTREAM_CONNECTIONS)
+        self.client = httpx.AsyncClient(limits=limits, follow_redirects=True)
+        self._running = {}  # key -> task prefetching it
+
+    async def fetch_product(self, gtin):
+        """Fetch a product like gtin_cache.fetch_open_food_facts()."""
+        try:
+            response = await self.client.get(OFF_URL.format(gtin=gtin), timeout=httpx.Timeout(PRODUCT_TIMEOUT, pool=UPSTREAM_QUEUE_TIMEOUT))
+            if response.status_code == 404:
+                return None
+            response.raise_for_status()
+            return parse_product(response.json())
+        except (httpx.HTTPError, ValueError) as e:
+            raise requests.ConnectionError(str(e)) from e
+
+    async def fetch_image(self, url):
+        """Return the bytes of an image."""
+        try:
+            response = await self.client.get(url, timeout=httpx.Timeout(IMAGE_TIMEOUT, pool=UPSTREAM_QUEUE_TIMEOUT))
+            response.raise_for_status()
+            return response.content
+        except httpx.HTTPError as e:
+            raise requests.ConnectionError(str(e)) from e
+
+    async def once(self, key, make):
+        """Run the coroutine make() unless it is already running for key, and
+           wait for it. A client going away doesn't cancel it for the others."""
+        task = self._running.get(key)
+        if task is None:
+            task = self._running[key] = asyncio.ensure_future(make())
+            task.add_done_callback(lambda _: self._running.pop(key, None))
+        await asyncio.shield(task)
+
+    async def prefetch(self, scope):
+        """Fill the caches for a request to /gtin/<code> or /images/<gtin>."""
+        if scope["method"] not in ("GET", "HEAD"):
+            return
+        match = GTIN_PATH.fullmatch(scope["path"])
+        if match:
+            gtin = match.group(1)
+            await self.once(("gtin", gtin), lambda: gtin_cache.prefetch(gtin, self.fetch_product))
+            return
+        match = IMAGE_PATH.fullmatch(scope["path"])
+        if match:
+            gtin = match.group(1)
+            try:
+                size = int(parse_qs(scope.get("query_string", b"").decode("latin-1")).get("size", ["180"])[0])
+            except ValueError:
+                # The view answers 400
+                return
+            await self.once(("image", gtin, size), lambda: image_cache.prefetch(
+                gtin, size, self.fetch_product, self.fetch_image))
+
+    async def close(self):
+        await self.client.aclose()
+
+#------------------ CHANGE FEED -----------------------------
+
+def header(scope, name):
+    """Return the value of a request header (name in lower case), or None."""
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+class ChangeFeed:
+    """Waits for the changes of /ingredients/changes on the event loop.
+
+       One thread watches the store on behalf of all waiting clients and
+       wakes them up when something changed; they then fetch their events
+       (without waiting) in a thread of their own. Open event streams and
+       long polls therefore don't tie up the worker threads of the views."""
+
+    def __init__(self):
+        self._changed = asyncio.Event()  # replaced after each change
+        self._clients = 0
+        self._watcher = None
+
+    async def watch(self, cursor):
+        """Wake up the clients on every change after the cursor, while there are any."""
+        while self._clients:
+            new_cursor, _ = await asyncio.to_thread(store.changes, cursor, timeout=CHANGES_POLL)
+            if new_cursor != cursor:
+                cursor = new_cursor
+                self._changed.set()
+                self._changed = asyncio.Event()
+
+    async def changes(self, since, timeout):
+        """Return store.changes(since) as soon as there are changes after the
+           cursor, or after `timeout` seconds."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        self._clients += 1
+        try:
+            while True:
+                changed = self._changed
+                cursor, events = await asyncio.to_thread(store.changes, since)
+                remaining = deadline - loop.time()
+                if since is None or events != [] or remaining <= 0:
+                    return cursor, events
+                if self._watcher is None or self._watcher.done():
+                    self._watcher = asyncio.ensure_future(self.watch(cursor))
+                try:
+                    await asyncio.wait_for(changed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._clients -= 1
+
+    async def stream(self, scope, receive, send):
+        """Send the events as Server-Sent Events like the Flask view, until
+           the client disconnects."""
+        start = time.perf_counter()
+        since = header(scope, b"last-event-id") or self.param(scope, "since")
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream; charset=utf-8"), (b"cache-control", b"no-cache")],
+        })
+        REQUEST_SECONDS.observe(time.perf_counter() - start, CHANGES_PATH, "GET")
+        REQUESTS.inc(CHANGES_PATH, "GET", 200)
+
+        async def send_text(text):
+            await send({"type": "http.response.body", "body": text.encode("utf-8"), "more_body": True})
+
+        async def events():
+            resume = since
+            if resume is None:
+                cursor, _ = await self.changes(None, 0)
+                await send_text(f"id: {cursor}\nevent: ready\ndata: {{}}\n\n")
+                resume = cursor
+            while True:
+                cursor, events = await self.changes(resume, CHANGES_KEEPALIVE)
+                await send_text(change_stream_text(cursor, events))
+                resume = cursor
+
+        async def disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        tasks = [asyncio.ensure_future(events()), asyncio.ensure_future(disconnect())]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+        for task in done:
+            # Raises if sending failed
+            task.result()
+
+    async def long_poll(self, scope):
+        """Wait for the changes of a long poll and return the scope of a
+           request the view answers without waiting. Invalid parameters are
+           left for the view to report."""
+        since = header(scope, b"last-event-id") or self.param(scope, "since")
+        try:
+            wait = float(self.param(scope, "wait") or 0)
+        except ValueError:
+            return scope
+        if since is None or not math.isfinite(wait) or wait <= 0:
+            return scope
+        await self.changes(since, min(wait, CHANGES_MAX_WAIT))
+        query = parse_qsl(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True)
+        return dict(scope, query_string=urlencode([(key, value) for key, value in query if key != "wait"]).encode("latin-1"))
+
+    @staticmethod
+    def param(scope, name):
+        """Return the first non-empty value of a query parameter, or None."""
+        return parse_qs(scope.get("query_string", b"").decode("latin-1")).get(name, [None])[0]
+
+    @staticmethod
+    def is_stream(scope):
+        return parse_accept_header(header(scope, b"accept"), MIMEAccept).best == "text/event-stream"
+
+#------------------ APPLICATION -----------------------------
+
+class DabbaASGI:
+    """The REST API and pages as an ASGI application (`uvicorn asgi:app`).
+
+       The Flask views of app.py answer every request, so routes and
+       responses are the same as with `python app.py`. They run in a pool of
+       worker threads, keeping file and database I/O off the event loop.
+       Requests that may have to ask Open Food Facts (/gtin/<code>,
+       /images/<gtin>) first wait for it on the event loop with a pooled async
+       HTTP client, so a slow upstream doesn't tie up a worker thread; the
+       view then answers from the cache. Event streams and long polls of
+       /ingredients/changes wait for changes on the event loop as well."""
+
+    def __init__(self, wsgi_app):
+        self.bridge = WSGIBridge(wsgi_app)
+        self.upstream = None
+        self.feed = ChangeFeed()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            # No WebSockets
+            return
+        if scope["method"] == "GET" and scope["path"] == CHANGES_PATH:
+            if self.feed.is_stream(scope):
+                await self.feed.stream(scope, receive, send)
+                return
+            scope = await self.feed.long_poll(scope)
+        if self.upstream is None:
+            # The client belongs to the server's event loop
+            self.upstream = Upstream()
+        try:
+            await self.upstream.prefetch(scope)
+        except Exception:
+            # The view tries again and reports the error
+            log.exception("Prefetching %s failed", scope["path"])
+        await self.bridge(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.upstream is not None:
+                    await self.upstream.close()
+                self.bridge.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+app = DabbaASGI(flask_app)
+
+if __name__ == "__main__":
+    import uvicorn
+    # Same port as the Flask development server
+    uvicorn.run(app, port=5000)
@@ -0,0 +1,239 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Pantry sizes measured by default
+SIZES = (1000, 10000, 100000, 1000000)
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Json", "Ingredient_Schema.json")
+
+# Building blocks of the synthetic ingredients
+NAME_WORDS = ["Gewürz", "Ketchup", "Curry", "Hafer", "Flocken", "Zart", "Basmati", "Reis", "Linsen", "Rot",
+              "Kichererbsen", "Tomaten", "Passiert", "Kokos", "Milch", "Senf", "Mittelscharf", "Paprika",
+              "Edelsüß", "Kreuzkümmel", "Ganz", "Bio", "Vollkorn", "Nudeln", "Olivenöl", "Nativ", "Honig",
+              "Cucumbers", "Chili", "Garam", "Masala", "Kurkuma", "Ingwer", "Erdnuss", "Butter", "Cashew"]
+PLACES = ["Fridge", "Fridge Door", "Freezer", "Keller", "Apothekerschrank", "Pantry", "Spice Box", "Drawer"]
+CATEGORIES = ["Condiment", "Grains", "Drink", "Vegetable", "Spice", "Legume", "Oil", "Dairy", "Snack", "Baking"]
+SOURCES = ["Lidl", "Edeka", "Kaufland", "Aldi", "Rewe", "Indian Store", "Market"]
+UNITS = ["g", "kg", "ml", "l", "piece"]
+ALLERGENES = ["mustard", "gluten", "peanuts", "nuts", "soy", "milk", "celery", "sesame"]
+STORAGE_CONDITIONS = ["cool", "dry", "dark", "frozen", "refrigerated"]
+DISTASTES = ["Ishita", "Michael", "coriander"]
+
+#------------------ DATA -----------------------------
+
+def generate_ingredient(rng, number):
+    """Return a schema-valid ingredient shaped like Ingredient_Example.json."""
+    name = " ".join(rng.sample(NAME_WORDS, rng.randint(1, 4)))
+    best_before = datetime.date(2025, 1, 1) + datetime.timedelta(days=rng.randint(0, 1500))
+    ingredient = {
+        "id": f"bench-{number:07d}",
+        "name": name,
+        "location": {"place": rng.choice(PLACES), "shelf": rng.randint(0, 6)},
+        "vegan_level": rng.randint(0, 4),
+        "diet_level": rng.randint(0, 2),
+        "size": {"value": rng.choice([100, 250, 400, 500, 750, 1000]), "unit": rng.choice(UNITS)},
+        "source": rng.choice(SOURCES),
+        # Both date formats occur: DD.MM.YYYY from the GUI, YYYY-MM-DD from the web form
+        "best_before_date": best_before.strftime("%d.%m.%Y") if rng.random() < 0.7 else best_before.isoformat(),
+        "nutritional_values": {
+            "energy": round(rng.uniform(0, 900), 1),
+            "fats": {"total": round(rng.uniform(0, 50), 1), "saturated": round(rng.uniform(0, 20), 1)},
+            "carbohydrates": {"total": round(rng.uniform(0, 80), 1), "sugar": round(rng.uniform(0, 40), 1)},
+            "proteins": round(rng.uniform(0, 30), 1),
+            "fiber": round(rng.uniform(0, 15), 1),
+            "salt": round(rng.uniform(0, 5), 2),
+        },
+        "storage_conditions": rng.sample(STORAGE_CONDITIONS, rng.randint(0, 2)),
+        "category": rng.choice(CATEGORIES),
+        "is_staple": rng.random() < 0.3,
+        "allergenes": rng.sample(ALLERGENES, rng.randint(0, 2)),
+        "personal_distaste": rng.sample(DISTASTES, rng.randint(0, 1)),
+        "synonyms": [" ".join(rng.sample(NAME_WORDS, 2))] if rng.random() < 0.5 else [],
+        "price": round(rng.uniform(0.19, 15), 2),
+    }
+    if rng.random() < 0.2:
+        ingredient["comment"] = "Delicious"
+    return ingredient
+
+def generate_ingredients(count, seed=0):
+    """Yield `count` synthetic ingredients; the same seed gives the same pantry."""
+    rng = random.Random(seed)
+    for number in range(count):
+        yield generate_ingredient(rng, number)
+
+def write_pantry(directory, count, storage, seed):
+    """Create Json/ with the schema and a pantry of `count` ingredients."""
+    json_dir = os.path.join(directory, "Json")
+    os.makedirs(json_dir)
+    shutil.copy(SCHEMA_FILE, json_dir)
+    path = os.path.join(json_dir, "Ingredients.json")
+    if storage == "sqlite":
+        from sqlite_store import SQLiteIngredientStore
+        target = SQLiteIngredientStore(os.path.join(json_dir, "Ingredients.db"))
+        batch = []
+        for ingredient in generate_ingredients(count, seed):
+            batch.append(ingredient)
+            if len(batch) == 10000:
+                target.add_many(batch)
+                batch = []
+        target.add_many(batch)
+        target.close()
+        with open(path, "w") as f:
+            f.write("[]")
+    else:
+        # Written one by one so the generator never holds the whole pantry
+        with open(path, "w") as f:
+            f.write("[\n")
+            for number, ingredient in enumerate(generate_ingredients(count, seed)):
+                f.write((",\n" if number else "") + json.dumps(ingredient, indent=4))
+            f.write("\n]")
+    return path
+
+#------------------ MEASURING -----------------------------
+
+def summarize(samples, errors=0):
+    """Return latency percentiles (ms) and throughput of a list of durations (s)."""
+    total = sum(samples)
+    ms = sorted(s * 1000 for s in samples)
+    if len(ms) > 1:
+        cuts = statistics.quantiles(ms, n=100, method="inclusive")
+        p50, p90, p99 = cuts[49], cuts[89], cuts[98]
+    else:
+        p50 = p90 = p99 = ms[0]
+    return {
+        "iterations": len(samples),
+        "errors": errors,
+        "total_s": round(total, 6),
+        "throughput_per_s": round(len(samples) / total, 2) if total else None,
+        "mean_ms": round(statistics.fmean(ms), 4),
+        "p50_ms": round(p50, 4),
+        "p90_ms": round(p90, 4),
+        "p99_ms": round(p99, 4),
+        "max_ms": round(ms[-1], 4),
+    }
+
+def measure(func, arguments):
+    """Call func once per argument and summarize the durations. A response
+       with a status code of 400 or more counts as an error."""
+    samples, errors = [], 0
+    for argument in arguments:
+        start = time.perf_counter()
+        result = func(argument)
+        samples.append(time.perf_counter() - start)
+        if getattr(result, "status_code", 200) >= 400:
+            errors += 1
+    return summarize(samples, errors)
+
+#------------------ BENCHMARK -----------------------------
+
+def run_size(appmod, count, storage, iterations, seed):
+    """Benchmark all operations on a pantry of `count` ingredients."""
+    from ingredient_store import get_store
+
+    directory = tempfile.mkdtemp(prefix=f"dabba-bench-{count}-")
+    try:
+        path = write_pantry(directory, count, storage, seed)
+
+        # Cold start: open the store and read everything once
+        start = time.perf_counter()
+        store = get_store(path)
+        store.refresh(force=True)
+        results = {"load": summarize([time.perf_counter() - start])}
+        appmod.store = store
+
+        client = appmod.app.test_client()
+        auth = {"Authorization": appmod.ADMIN_PASSWORD}
+        rng = random.Random(seed + 1)
+        ids = [f"bench-{rng.randrange(count):07d}" for _ in range(iterations)]
+        words = [rng.choice(NAME_WORDS).lower()[:rng.randint(3, 6)] for _ in range(iterations)]
+        fresh = list(generate_ingredients(iterations, seed + 2))
+        for number, ingredient in enumerate(fresh):
+            ingredient["id"] = f"bench-new-{number:07d}"
+
+        results["list_page"] = measure(
+            lambda offset: client.get(f"/ingredients?limit=50&offset={offset}&sort=name"),
+            [rng.randrange(count) for _ in range(iterations)])
+        results["list_filtered"] = measure(
+            lambda place: client.get(f"/ingredients?place={place}&limit=50"),
+            [rng.choice(PLACES) for _ in range(iterations)])
+        results["list_all"] = measure(lambda _: client.get("/ingredients"), range(max(1, iterations // 20)))
+        results["get"] = measure(lambda id: client.get(f"/ingredients/{id}"), ids)
+        results["search"] = measure(lambda word: client.get(f"/ingredients/search?q={word}&limit=50"), words)
+        results["validate"] = measure(appmod.validator.validate, fresh)
+        results["add"] = measure(lambda ing: client.post("/ingredients?force=1", json=ing), fresh)
+        results["update"] = measure(
+            lambda ing: client.put(f"/ingredients/{ing['id']}", json=dict(ing, name=ing["name"] + " Neu"), headers=auth),
+            fresh)
+        results["delete"] = measure(lambda ing: client.delete(f"/ingredients/{ing['id']}", headers=auth), fresh)
+        store.close()
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def git_revision():
+    """Return the current git commit of the repository, if known."""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(sizes, storage="json", iterations=200, seed=0):
+    """Run the benchmark for all sizes and return the results as a dict."""
+    import ingredient_store
+    ingredient_store.STORAGE_MODE = storage
+
+    # app.py opens Json/ relative to the working directory when imported
+    home = tempfile.mkdtemp(prefix="dabba-bench-")
+    cwd = os.getcwd()
+    try:
+        write_pantry(os.path.join(home, "app"), 0, storage, seed)
+        os.chdir(os.path.join(home, "app"))
+        import app as appmod
+        report = {
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "storage": storage,
+            "iterations": iterations,
+            "seed": seed,
+            "results": {},
+        }
+        for count in sizes:
+            print(f"Benchmarking {count} ingredients ({storage})...", file=sys.stderr)
+            report["results"][str(count)] = run_size(appmod, count, storage, iterations, seed)
+        return report
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(home, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Dabba REST API on synthetic pantries.")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in SIZES),
+                        help="comma separated numbers of ingredients")
+    parser.add_argument("--storage", choices=("json", "journal", "sqlite"), default="json", help="storage mode")
+    parser.add_argument("--iterations", type=int, default=200, help="requests per operation")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the data generator")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    report = run(sizes, args.storage, args.iterations, args.seed)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#------------------ FUNCTIONS -----------------------------
+
+# Fields with one bitset per value
+BITSET_FIELDS = ("allergenes", "personal_distaste", "vegan_level", "diet_level")
+
+def normalize(value):
+    """Allergens and distastes are matched case-insensitively."""
+    return value.strip().casefold() if isinstance(value, str) else value
+
+def field_values(ingredient, field):
+    value = ingredient.get(field)
+    values = value if isinstance(value, list) else [value]
+    return {normalize(v) for v in values if v is not None and v != ""}
+
+def set_bits(number):
+    """Yield the positions of the 1 bits of a non-negative int, lowest first."""
+    bits = bin(number)[:1:-1]
+    i = bits.find("1")
+    while i != -1:
+        yield i
+        i = bits.find("1", i + 1)
+
+def to_int(bits):
+    return int.from_bytes(bits, "little")
+
+#------------------ INDEX -----------------------------
+
+class BitsetIndex:
+    """One bitset per allergen, distaste, vegan level and diet level.
+
+       Every ingredient gets a slot (freed slots are reused) and bit `slot`
+       is set in the bitset of each of its values. "Safe for this guest"
+       queries are then a few AND/OR operations on whole bitsets instead
+       of a check per ingredient. Bitsets are mutable bytearrays, so an
+       ingredient is added or removed by flipping its bits."""
+
+    def __init__(self):
+        self._slots = {}        # id -> slot
+        self._ids = []          # slot -> id (None if free)
+        self._free = []         # free slots
+        self._present = bytearray()
+        self._bitsets = {field: {} for field in BITSET_FIELDS}    # field -> value -> bytearray
+
+    def rebuild(self, ingredients):
+        """Index all ingredients from scratch."""
+        self.__init__()
+        for ingredient in ingredients:
+            self.add(ingredient)
+
+    def _set(self, bits, slot, on):
+        byte = slot >> 3
+        if len(bits) <= byte:
+            bits.extend(bytes(byte + 1 - len(bits)))
+        if on:
+            bits[byte] |= 1 << (slot & 7)
+        else:
+            bits[byte] &= ~(1 << (slot & 7)) & 0xFF
+
+    def add(self, ingredient):
+        """Index an ingredient."""
+        if self._free:
+            slot = self._free.pop()
+            self._ids[slot] = ingredient["id"]
+        else:
+            slot = len(self._ids)
+            self._ids.append(ingredient["id"])
+        self._slots[ingredient["id"]] = slot
+        self._set(self._present, slot, True)
+        for field in BITSET_FIELDS:
+            for value in field_values(ingredient, field):
+                self._set(self._bitsets[field].setdefault(value, bytearray()), slot, True)
+
+    def remove(self, ingredient):
+        """Remove an ingredient from the index."""
+        slot = self._slots.pop(ingredient["id"], None)
+        if slot is None:
+            return
+        self._set(self._present, slot, False)
+        for field in BITSET_FIELDS:
+            for value in field_values(ingredient, field):
+                bits = self._bitsets[field].get(value)
+                if bits is not None:
+                    self._set(bits, slot, False)
+        self._ids[slot] = None
+        self._free.append(slot)
+
+    def _levels(self, field, accept):
+        """Return the union of the bitsets of all levels accepted by `accept`."""
+        result = 0
+        for level, bits in self._bitsets[field].items():
+            if isinstance(level, int) and accept(level):
+                result |= to_int(bits)
+        return result
+
+    def match(self, exclude_allergens=(), exclude_distaste=(), min_vegan=None, max_diet=None):
+        """Return the IDs of ingredients that contain none of the allergens and
+           distastes, have vegan_level >= min_vegan and diet_level <= max_diet."""
+        result = to_int(self._present)
+        for field, values in (("allergenes", exclude_allergens), ("personal_distaste", exclude_distaste)):
+            for value in values:
+                bits = self._bitsets[field].get(normalize(value))
+                if bits:
+                    result &= ~to_int(bits)
+        if min_vegan is not None:
+            result &= self._levels("vegan_level", lambda level: level >= min_vegan)
+        if max_diet is not None:
+            result &= self._levels("diet_level", lambda level: level <= max_diet)
+        return [self._ids[slot] for slot in set_bits(result)]
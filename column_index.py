@@ -0,0 +1,163 @@
+import numpy as np
+
+# Numeric fields that statistics can be computed for -> path into the ingredient
+STAT_FIELDS = {
+    "price": ("price",),
+    "size_value": ("size", "value"),
+    "energy": ("nutritional_values", "energy"),
+    "fats_total": ("nutritional_values", "fats", "total"),
+    "fats_saturated": ("nutritional_values", "fats", "saturated"),
+    "carbohydrates_total": ("nutritional_values", "carbohydrates", "total"),
+    "sugar": ("nutritional_values", "carbohydrates", "sugar"),
+    "proteins": ("nutritional_values", "proteins"),
+    "fiber": ("nutritional_values", "fiber"),
+    "salt": ("nutritional_values", "salt"),
+}
+
+# Fields statistics can be grouped and filtered by -> path into the ingredient
+GROUP_FIELDS = {
+    "category": ("category",),
+    "place": ("location", "place"),
+    "source": ("source",),
+    "vegan_level": ("vegan_level",),
+    "diet_level": ("diet_level",),
+}
+
+#------------------ FUNCTIONS -----------------------------
+
+def _value(ingredient, path):
+    value = ingredient
+    for key in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+def _number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return np.nan
+    return value
+
+#------------------ INDEX -----------------------------
+
+class ColumnIndex:
+    """Columnar copy of the numeric STAT_FIELDS of all ingredients.
+
+       Every field is a float64 array (NaN where the value is missing) and
+       every GROUP_FIELDS key is an array of codes into a list of its
+       distinct values (-1 where missing), so statistics are computed with
+       vectorized NumPy reductions. Rows are updated incrementally when
+       ingredients change; deleted rows are filled with the last row."""
+
+    def __init__(self):
+        self._rows = {}         # id -> row
+        self._ids = []          # row -> id
+        self._size = 0
+        self._values = np.empty((len(STAT_FIELDS), 0))
+        self._codes = np.empty((len(GROUP_FIELDS), 0), dtype=np.int32)
+        self._keys = {field: [] for field in GROUP_FIELDS}     # field -> code -> value
+        self._key_codes = {field: {} for field in GROUP_FIELDS}  # field -> value -> code
+
+    def rebuild(self, ingredients):
+        """Fill the columns from scratch."""
+        self.__init__()
+        self._grow(len(ingredients))
+        for ingredient in ingredients:
+            self.add(ingredient)
+
+    def _grow(self, capacity):
+        """Make room for at least `capacity` rows."""
+        if capacity <= self._values.shape[1]:
+            return
+        capacity = max(capacity, 2 * self._values.shape[1], 64)
+        values = np.full((len(STAT_FIELDS), capacity), np.nan)
+        values[:, :self._size] = self._values[:, :self._size]
+        codes = np.full((len(GROUP_FIELDS), capacity), -1, dtype=np.int32)
+        codes[:, :self._size] = self._codes[:, :self._size]
+        self._values, self._codes = values, codes
+
+    def _code(self, field, value):
+        if value is None or value == "":
+            return -1
+        codes = self._key_codes[field]
+        if value not in codes:
+            codes[value] = len(self._keys[field])
+            self._keys[field].append(value)
+        return codes[value]
+
+    def add(self, ingredient):
+        """Add an ingredient as a new row."""
+        self._grow(self._size + 1)
+        row = self._size
+        self._size += 1
+        self._rows[ingredient["id"]] = row
+        self._ids.append(ingredient["id"])
+        self._values[:, row] = [_number(_value(ingredient, path)) for path in STAT_FIELDS.values()]
+        self._codes[:, row] = [self._code(field, _value(ingredient, path)) for field, path in GROUP_FIELDS.items()]
+
+    def remove(self, ingredient):
+        """Remove the row of an ingredient."""
+        row = self._rows.pop(ingredient["id"], None)
+        if row is None:
+            return
+        last = self._size - 1
+        if row != last:
+            self._values[:, row] = self._values[:, last]
+            self._codes[:, row] = self._codes[:, last]
+            self._ids[row] = self._ids[last]
+            self._rows[self._ids[row]] = row
+        self._ids.pop()
+        self._size = last
+
+    def stats(self, fields=None, group_by=None, filters=None):
+        """Return the number of ingredients and count, sum, mean, min and max
+           of the given STAT_FIELDS (default all) for the ingredients matching
+           the GROUP_FIELDS filters. Missing values are ignored.
+           With group_by a list with one such dict per value is returned,
+           ordered by value (ingredients without a value last)."""
+        fields = fields or list(STAT_FIELDS)
+        mask = np.ones(self._size, dtype=bool)
+        for key, value in (filters or {}).items():
+            codes = self._codes[list(GROUP_FIELDS).index(key), :self._size]
+            # Filter values arrive as text, levels are stored as numbers
+            matching = [code for code, v in enumerate(self._keys[key]) if str(v) == value]
+            mask &= np.isin(codes, matching)
+
+        if group_by:
+            codes = self._codes[list(GROUP_FIELDS).index(group_by), :self._size][mask]
+            keys = self._keys[group_by]
+        else:
+            codes = np.zeros(int(mask.sum()), dtype=np.int32)
+            keys = [None]
+        # Ingredients without a group value form the last group
+        codes = np.where(codes < 0, len(keys), codes)
+        groups = len(keys) + 1
+        counts = np.bincount(codes, minlength=groups)
+
+        columns = {}
+        for field in fields:
+            values = self._values[list(STAT_FIELDS).index(field), :self._size][mask]
+            present = ~np.isnan(values)
+            group, values = codes[present], values[present]
+            mins = np.full(groups, np.inf)
+            maxs = np.full(groups, -np.inf)
+            np.minimum.at(mins, group, values)
+            np.maximum.at(maxs, group, values)
+            columns[field] = (np.bincount(group, minlength=groups),
+                              np.bincount(group, weights=values, minlength=groups), mins, maxs)
+
+        def group_stats(group):
+            stats = {"count": int(counts[group])}
+            for field, (n, sums, mins, maxs) in columns.items():
+                n = int(n[group])
+                stats[field] = {"count": n, "sum": float(sums[group]),
+                                "mean": float(sums[group] / n) if n else None,
+                                "min": float(mins[group]) if n else None,
+                                "max": float(maxs[group]) if n else None}
+            return stats
+
+        if not group_by:
+            return group_stats(0)
+        order = sorted(range(len(keys)), key=lambda code: (isinstance(keys[code], str), keys[code])) + [len(keys)]
+        return [{group_by: keys[code] if code < len(keys) else None, **group_stats(code)}
+                for code in order if counts[code]]
@@ -0,0 +1,183 @@
+import re
+import zlib
+
+import numpy as np
+
+from search_index import fold
+
+# MinHash signatures have NUM_BANDS * BAND_ROWS values. Two ingredients become
+# candidates if all values of one band agree, which happens for a Jaccard
+# similarity s with probability 1 - (1 - s^BAND_ROWS)^NUM_BANDS: 97% at 0.6,
+# 99.9% at 0.7 and 18% at 0.3.
+NUM_BANDS = 25
+BAND_ROWS = 4
+NUM_HASHES = NUM_BANDS * BAND_ROWS
+# Trigram Jaccard similarity from which two ingredients are probable duplicates
+DUPLICATE_THRESHOLD = 0.6
+
+# Multiply-shift hash functions h(x) = (a * x + b) mod 2^64 >> 32 with fixed
+# random 64 bit a (odd) and b; the product has to wrap around, otherwise every
+# function would order the trigrams the same way
+_random = np.random.default_rng(20240601)
+_A = (_random.integers(0, 2**64, NUM_HASHES, dtype=np.uint64) | np.uint64(1))[:, None]
+_B = _random.integers(0, 2**64, NUM_HASHES, dtype=np.uint64)[:, None]
+# Ingredients hashed together when rebuilding (bounds the memory used)
+BATCH_SIZE = 2000
+
+#------------------ FUNCTIONS -----------------------------
+
+def normalize_name(text):
+    """Fold case and accents and reduce a name to its words ("Gewürz-Ketchup!" -> "gewurz ketchup")."""
+    return " ".join(re.findall(r"\w+", fold(text)))
+
+def shingles(ingredient):
+    """Return the character trigrams of the normalized name and synonyms."""
+    result = set()
+    for text in [ingredient.get("name") or ""] + list(ingredient.get("synonyms") or []):
+        text = f" {normalize_name(str(text))} "
+        result.update(text[i:i + 3] for i in range(len(text) - 2))
+    return result
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b)
+
+def signatures(shingle_sets):
+    """Return the MinHash signatures of non-empty shingle sets, one row of
+       NUM_HASHES values per set."""
+    result = np.empty((len(shingle_sets), NUM_HASHES), dtype=np.uint64)
+    for start in range(0, len(shingle_sets), BATCH_SIZE):
+        batch = shingle_sets[start:start + BATCH_SIZE]
+        lengths = np.array([len(s) for s in batch])
+        hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for s in batch for shingle in s),
+                             dtype=np.uint64, count=int(lengths.sum()))
+        values = (_A * hashes + _B) >> np.uint64(32)
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        result[start:start + len(batch)] = np.minimum.reduceat(values, offsets, axis=1).T
+    return result
+
+def band_keys(rows):
+    """Return the bucket key of every band of the given signatures, one list
+       of ints per signature. Keys of different bands can collide, which only
+       adds candidates that fail the similarity check."""
+    bands = rows.reshape(len(rows), NUM_BANDS, BAND_ROWS)
+    keys = bands[:, :, 0].copy()
+    for row in range(1, BAND_ROWS):
+        keys = keys * np.uint64(0x9E3779B97F4A7C15) ^ bands[:, :, row]
+    return keys.tolist()
+
+#------------------ INDEX -----------------------------
+
+class DuplicateIndex:
+    """MinHash-LSH index over the trigrams of name and synonyms for finding
+       probable duplicates, e.g. the same product stored twice under slightly
+       different names or on another shelf.
+
+       Every ingredient's MinHash signature is cut into NUM_BANDS bands; only
+       ingredients sharing the bucket of at least one band are compared (by the
+       exact Jaccard similarity of their trigrams), so a lookup does not scan
+       all ingredients. The buckets are updated incrementally when ingredients
+       change."""
+
+    def __init__(self):
+        self._shingles = {}     # id -> set of trigrams
+        self._keys = {}         # id -> bucket key per band
+        # band -> bucket key -> id, or set of ids if several share the bucket
+        # (most buckets hold one ingredient; millions of small sets would keep
+        # the garbage collector busy)
+        self._buckets = [{} for _ in range(NUM_BANDS)]
+
+    def rebuild(self, ingredients):
+        """Index all ingredients from scratch."""
+        self.__init__()
+        items = [(ingredient["id"], shingles(ingredient)) for ingredient in ingredients]
+        items = [(id, s) for id, s in items if s]
+        for (id, s), keys in zip(items, band_keys(signatures([s for _, s in items]))):
+            self._insert(id, s, keys)
+
+    def _insert(self, id, shingle_set, keys):
+        for buckets, key in zip(self._buckets, keys):
+            ids = buckets.get(key)
+            if ids is None:
+                buckets[key] = id
+            elif isinstance(ids, set):
+                ids.add(id)
+            else:
+                buckets[key] = {ids, id}
+        self._shingles[id] = shingle_set
+        self._keys[id] = keys
+
+    def add(self, ingredient):
+        """Index an ingredient."""
+        shingle_set = shingles(ingredient)
+        if shingle_set:
+            self._insert(ingredient["id"], shingle_set, band_keys(signatures([shingle_set]))[0])
+
+    def remove(self, ingredient):
+        """Remove an ingredient (only its "id" is used) from the index."""
+        keys = self._keys.pop(ingredient["id"], None)
+        if keys is None:
+            return
+        del self._shingles[ingredient["id"]]
+        for buckets, key in zip(self._buckets, keys):
+            ids = buckets[key]
+            if not isinstance(ids, set):
+                del buckets[key]
+                continue
+            ids.discard(ingredient["id"])
+            if len(ids) == 1:
+                buckets[key] = ids.pop()
+
+    def similar(self, ingredient, threshold=DUPLICATE_THRESHOLD):
+        """Return [(id, similarity)] of the indexed ingredients at least
+           `threshold` similar to the given one, most similar first. An indexed
+           ingredient with the same ID is skipped."""
+        shingle_set = shingles(ingredient)
+        if not shingle_set:
+            return []
+        candidates = set()
+        for buckets, key in zip(self._buckets, band_keys(signatures([shingle_set]))[0]):
+            ids = buckets.get(key)
+            if isinstance(ids, set):
+                candidates.update(ids)
+            elif ids is not None:
+                candidates.add(ids)
+        candidates.discard(ingredient.get("id"))
+        scores = ((id, jaccard(shingle_set, self._shingles[id])) for id in candidates)
+        return sorted((item for item in scores if item[1] >= threshold), key=lambda item: (-item[1], item[0]))
+
+    def duplicates(self, threshold=DUPLICATE_THRESHOLD):
+        """Return groups of probable duplicates as [(ids, similarity)], where
+           every ID is at least `threshold` similar to another one of its group
+           and similarity is the highest within the group; most similar first."""
+        parent = {}
+
+        def root(id):
+            while parent.get(id, id) != id:
+                id = parent[id]
+            return id
+
+        best, compared = {}, set()
+        for buckets in self._buckets:
+            for ids in buckets.values():
+                if not isinstance(ids, set):
+                    continue
+                ids = sorted(ids)
+                for i, a in enumerate(ids):
+                    for b in ids[i + 1:]:
+                        if (a, b) in compared:
+                            continue
+                        compared.add((a, b))
+                        similarity = jaccard(self._shingles[a], self._shingles[b])
+                        if similarity < threshold:
+                            continue
+                        ra, rb = root(a), root(b)
+                        if ra != rb:
+                            parent[rb] = ra
+                            best[ra] = max(best.pop(rb, 0.0), best.get(ra, 0.0))
+                        best[ra] = max(best.get(ra, 0.0), similarity)
+
+        groups = {id: {id} for id in best}
+        for id in parent:
+            groups[root(id)].add(id)
+        result = [(sorted(members), best[id]) for id, members in groups.items()]
+        return sorted(result, key=lambda group: (-group[1], group[0]))
@@ -0,0 +1,54 @@
+import bisect
+import datetime
+
+#------------------ FUNCTIONS -----------------------------
+
+def parse_best_before(value):
+    """Parse a best before date (DD.MM.YYYY from the GUI, YYYY-MM-DD from the
+       web form). Returns None if it is missing or invalid."""
+    for fmt in ("%d.%m.%Y", "%Y-%m-%d"):
+        try:
+            return datetime.datetime.strptime(value, fmt).date()
+        except (TypeError, ValueError):
+            pass
+    return None
+
+#------------------ INDEX -----------------------------
+
+class ExpiryIndex:
+    """Ingredients ordered by their parsed best_before_date.
+
+       Keeps a sorted list of (date, id), so the ingredients expiring in a
+       date range are found with a binary search instead of parsing every
+       date. Ingredients without a (valid) date are not indexed. The index is
+       updated incrementally when ingredients change."""
+
+    def __init__(self):
+        self._entries = []      # sorted list of (date, id)
+
+    def rebuild(self, ingredients):
+        """Index all ingredients from scratch."""
+        self._entries = sorted((date, ing["id"]) for ing in ingredients
+                               if (date := parse_best_before(ing.get("best_before_date"))))
+
+    def add(self, ingredient):
+        """Index an ingredient."""
+        date = parse_best_before(ingredient.get("best_before_date"))
+        if date:
+            bisect.insort(self._entries, (date, ingredient["id"]))
+
+    def remove(self, ingredient):
+        """Remove an ingredient from the index."""
+        date = parse_best_before(ingredient.get("best_before_date"))
+        if date:
+            i = bisect.bisect_left(self._entries, (date, ingredient["id"]))
+            if i < len(self._entries) and self._entries[i] == (date, ingredient["id"]):
+                del self._entries[i]
+
+    def between(self, start, end):
+        """Yield the IDs of ingredients with start <= date <= end (either may
+           be None for an open range), soonest first."""
+        i = bisect.bisect_left(self._entries, (start,)) if start else 0
+        while i < len(self._entries) and (end is None or self._entries[i][0] <= end):
+            yield self._entries[i][1]
+            i += 1
@@ -0,0 +1,65 @@
+#------------------ FACETS -----------------------------
+
+# Facet name -> path into the ingredient. List fields count every element.
+FACET_FIELDS = {
+    "category": ("category",),
+    "location.place": ("location", "place"),
+    "location.shelf": ("location", "shelf"),
+    "size.unit": ("size", "unit"),
+    "source": ("source",),
+    "allergenes": ("allergenes",),
+    "storage_conditions": ("storage_conditions",),
+}
+
+def facet_values(ingredient, path):
+    """Return the values of an ingredient for a facet path (empty values are skipped)."""
+    value = ingredient
+    for key in path:
+        if not isinstance(value, dict):
+            return []
+        value = value.get(key)
+    values = value if isinstance(value, list) else [value]
+    return [v for v in values if v is not None and v != ""]
+
+def facet_sort_key(item):
+    """Order facet values: numbers (shelves) numerically, then text."""
+    return (isinstance(item[0], str), item[0])
+
+#------------------ INDEX -----------------------------
+
+class FacetIndex:
+    """Number of ingredients per value of each of the FACET_FIELDS, e.g. how
+       many ingredients are in each category. Used for the dropdowns of the
+       GUI and the web form. The counts are updated incrementally when
+       ingredients change."""
+
+    def __init__(self):
+        self._counts = {facet: {} for facet in FACET_FIELDS}    # facet -> {value: count}
+
+    def rebuild(self, ingredients):
+        """Count all ingredients from scratch."""
+        self.__init__()
+        for ingredient in ingredients:
+            self.add(ingredient)
+
+    def add(self, ingredient):
+        """Count an ingredient."""
+        for facet, path in FACET_FIELDS.items():
+            counts = self._counts[facet]
+            for value in set(facet_values(ingredient, path)):
+                counts[value] = counts.get(value, 0) + 1
+
+    def remove(self, ingredient):
+        """Stop counting an ingredient."""
+        for facet, path in FACET_FIELDS.items():
+            counts = self._counts[facet]
+            for value in set(facet_values(ingredient, path)):
+                counts[value] -= 1
+                if not counts[value]:
+                    del counts[value]
+
+    def facets(self, names=None):
+        """Return {facet: {value: count}} for the given facets (default all),
+           values in sorted order."""
+        return {facet: dict(sorted(self._counts[facet].items(), key=facet_sort_key))
+                for facet in (names or FACET_FIELDS)}
@@ -0,0 +1,80 @@
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+#------------------ LOCK -----------------------------
+
+class FileLock:
+    """Exclusive lock shared by all processes using the same lock file, e.g.
+       several API workers and the GUI writing the same database.
+
+       Uses flock() on POSIX and msvcrt.locking() on Windows. The lock is
+       re-entrant within a process; threads of the same process must be
+       serialized by the caller (the stores hold their own lock first)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._depth = 0
+        self._guard = threading.Lock()
+
+    def acquire(self):
+        with self._guard:
+            if self._depth == 0:
+                f = open(self.path, "a+b")
+                try:
+                    if fcntl:
+                        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                    else:
+                        # Lock the first byte; retries for 10 seconds, then raises OSError
+                        f.seek(0)
+                        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                except BaseException:
+                    f.close()
+                    raise
+                self._file = f
+            self._depth += 1
+
+    def release(self):
+        with self._guard:
+            self._depth -= 1
+            if self._depth == 0:
+                if fcntl:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+                else:
+                    self._file.seek(0)
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def atomic_write(path, data):
+    """Write bytes to a file so that readers see either the old or the new
+       content, never a half-written file. Threads writing the same file at
+       the same time each use their own temporary file; the last one wins."""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
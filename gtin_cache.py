@@ -0,0 +1,178 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+
+from metrics import CACHE_LOOKUPS
+
+# Open Food Facts product API; can point to a local stub for tests
+OFF_URL = os.environ.get("DABBA_OFF_URL", "https://world.openfoodfacts.org/api/v0/product/{gtin}.json")
+# Never ask Open Food Facts, only answer from the cache
+OFFLINE = os.environ.get("DABBA_OFFLINE", "") not in ("", "0")
+# Seconds a failed asynchronous fetch counts for the next lookup (see FailureMemo)
+FAILURE_MEMO_SECONDS = 30
+
+# Product fields kept in the cache (everything the GUI and the web pages use)
+PRODUCT_FIELDS = ("product_name", "brands", "quantity", "generic_name", "allergens_tags", "nutriments",
+                  "image_url", "image_front_url", "image_small_url")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    gtin TEXT PRIMARY KEY,
+    product TEXT,           -- JSON, NULL if Open Food Facts does not know the GTIN
+    fetched_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_products_used_at ON products(used_at);
+"""
+
+#------------------ FUNCTIONS -----------------------------
+
+session = requests.Session()
+
+def is_gtin(code):
+    """Check whether a code looks like a GTIN (8 to 14 ASCII digits)."""
+    return code.isascii() and code.isdigit() and 8 <= len(code) <= 14
+
+def fetch_open_food_facts(gtin, timeout=5):
+    """Fetch a product from Open Food Facts. Returns None if it is unknown.
+       Raises requests.RequestException if Open Food Facts can't be reached."""
+    response = session.get(OFF_URL.format(gtin=gtin), timeout=timeout)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return parse_product(response.json())
+
+def parse_product(data):
+    """Return the cached fields of the product in an Open Food Facts API
+       response, or None if the product is unknown."""
+    if data.get("status") != 1 or "product" not in data:
+        return None
+    return {key: data["product"][key] for key in PRODUCT_FIELDS if key in data["product"]}
+
+#------------------ CACHE -----------------------------
+
+class FailureMemo:
+    """Keys whose asynchronous fetch failed recently. Requests that already
+       waited for upstream to fail (see GTINCache.prefetch()) are then answered
+       as unreachable right away instead of waiting for it a second time."""
+
+    def __init__(self, seconds=FAILURE_MEMO_SECONDS, max_entries=1000):
+        self.seconds = seconds
+        self.max_entries = max_entries
+        self._failed = {}   # key -> time.monotonic() of the failure
+
+    def add(self, key):
+        if len(self._failed) >= self.max_entries:
+            self._failed.clear()
+        self._failed[key] = time.monotonic()
+
+    def discard(self, key):
+        self._failed.pop(key, None)
+
+    def failed(self, key):
+        """Return True if fetching key failed within the last seconds."""
+        failed = self._failed.get(key)
+        return failed is not None and time.monotonic() - failed < self.seconds
+
+class GTINCache:
+    """On-disk cache of Open Food Facts products.
+
+       Entries are fresh for `ttl` seconds. Older entries are refreshed from
+       `upstream` (a function gtin -> product or None), but still served if
+       it can't be reached. The least recently used entries are evicted
+       beyond `max_entries`."""
+
+    def __init__(self, path, ttl=30 * 24 * 3600, max_entries=10000, upstream=fetch_open_food_facts, offline=OFFLINE):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.upstream = upstream
+        self.offline = offline
+        self._failures = FailureMemo()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def _cached(self, gtin):
+        with self._lock:
+            row = self._conn.execute("SELECT product, fetched_at FROM products WHERE gtin = ?", (gtin,)).fetchone()
+            if row:
+                self._conn.execute("UPDATE products SET used_at = ? WHERE gtin = ?", (time.time(), gtin))
+        return row
+
+    def _store(self, gtin, product):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?)",
+                               (gtin, json.dumps(product) if product is not None else None, now, now))
+            # Evict the least recently used products
+            self._conn.execute(
+                "DELETE FROM products WHERE gtin IN "
+                "(SELECT gtin FROM products ORDER BY used_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def _fresh(self, row):
+        return row is not None and (self.offline or time.time() - row[1] < self.ttl)
+
+    def lookup(self, gtin):
+        """Return the product, or None if the GTIN is unknown.
+           Raises requests.RequestException if the product is not cached and
+           Open Food Facts can't be reached (or the cache is offline)."""
+        row = self._cached(gtin)
+        if self._fresh(row):
+            CACHE_LOOKUPS.inc("gtin", "hit")
+            return json.loads(row[0]) if row[0] else None
+        if self.offline:
+            CACHE_LOOKUPS.inc("gtin", "miss")
+            raise requests.ConnectionError("Offline and GTIN not cached")
+        try:
+            if self._failures.failed(gtin):
+                raise requests.ConnectionError("Open Food Facts was not reachable just now")
+            product = self.upstream(gtin)
+        except requests.RequestException:
+            if row:
+                # Stale, but better than nothing
+                CACHE_LOOKUPS.inc("gtin", "stale")
+                return json.loads(row[0]) if row[0] else None
+            CACHE_LOOKUPS.inc("gtin", "miss")
+            raise
+        CACHE_LOOKUPS.inc("gtin", "miss")
+        self._store(gtin, product)
+        return product
+
+    async def prefetch(self, gtin, fetch):
+        """Make sure the next lookup() of a GTIN is answered without waiting
+           for upstream: refresh it with the coroutine function `fetch` (gtin ->
+           product or None, raising requests.RequestException) unless it is
+           cached and fresh. If fetch fails, lookup() answers as if upstream
+           was unreachable for the next FAILURE_MEMO_SECONDS. The database is accessed in a worker
+           thread. Returns the product lookup() will return (None if unknown
+           or unreachable)."""
+        row = await asyncio.to_thread(self._cached, gtin)
+        if self._fresh(row) or self.offline:
+            return json.loads(row[0]) if row and row[0] else None
+        try:
+            product = await fetch(gtin)
+        except requests.RequestException:
+            self._failures.add(gtin)
+            return json.loads(row[0]) if row and row[0] else None
+        self._failures.discard(gtin)
+        await asyncio.to_thread(self._store, gtin, product)
+        return product
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_gtin_cache(path):
+    """Return the process-wide GTIN cache for the given file."""
+    path = os.path.abspath(path)
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = GTINCache(path)
+        return _caches[path]
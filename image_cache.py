@@ -0,0 +1,231 @@
+import asyncio
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+from PIL import Image
+
+from file_lock import atomic_write
+from gtin_cache import FailureMemo, session
+from metrics import CACHE_LOOKUPS
+
+# Thumbnails generated for every image (maximum width and height in pixels)
+THUMBNAIL_SIZES = (90, 180, 360, 720)
+# WebP quality of the thumbnails (0-100)
+WEBP_QUALITY = 80
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    gtin TEXT PRIMARY KEY,
+    url TEXT NOT NULL,      -- Open Food Facts image the thumbnails were made from
+    digest TEXT NOT NULL,   -- SHA-256 of the downloaded image
+    checked_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_images_digest ON images(digest);
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    bytes INTEGER NOT NULL, -- Size of all thumbnails of the image on disk
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_blobs_used_at ON blobs(used_at);
+"""
+
+#------------------ FUNCTIONS -----------------------------
+
+def standard_size(size):
+    """Return the smallest of the THUMBNAIL_SIZES that is at least `size`
+       (the largest one for bigger sizes)."""
+    for standard in THUMBNAIL_SIZES:
+        if standard >= size:
+            return standard
+    return THUMBNAIL_SIZES[-1]
+
+def product_image_url(product):
+    """Return the best available image URL of an Open Food Facts product."""
+    return product.get("image_url") or product.get("image_front_url") or product.get("image_small_url")
+
+def make_thumbnails(data):
+    """Decode an image once and return {size: WebP bytes} for all THUMBNAIL_SIZES."""
+    image = Image.open(io.BytesIO(data))
+    image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+    thumbnails = {}
+    for size in THUMBNAIL_SIZES:
+        thumbnail = image.copy()
+        thumbnail.thumbnail((size, size), Image.Resampling.LANCZOS)
+        output = io.BytesIO()
+        thumbnail.save(output, "WEBP", quality=WEBP_QUALITY, method=4)
+        thumbnails[size] = output.getvalue()
+    return thumbnails
+
+#------------------ CACHE -----------------------------
+
+class ImageCache:
+    """On-disk cache of product image thumbnails.
+
+       Images are downloaded once, decoded once and stored as WebP
+       thumbnails in all THUMBNAIL_SIZES under <directory>/<aa>/<digest>-<size>.webp,
+       where digest is the SHA-256 of the original image, so products with
+       the same picture share their thumbnails. Which image belongs to a
+       GTIN is re-checked against the GTIN cache after `ttl` seconds. The
+       least recently used images are evicted beyond `max_bytes`."""
+
+    def __init__(self, directory, gtin_cache, ttl=30 * 24 * 3600, max_bytes=100 * 1024 * 1024):
+        self.directory = directory
+        self.gtin_cache = gtin_cache
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._failures = FailureMemo()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(directory, "images.db"), check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def _path(self, digest, size):
+        return os.path.join(self.directory, digest[:2], f"{digest}-{size}.webp")
+
+    def _read(self, digest, size):
+        """Return the bytes of a thumbnail, or None if it is missing."""
+        try:
+            with open(self._path(digest, size), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _cached(self, gtin):
+        with self._lock:
+            return self._conn.execute("SELECT url, digest, checked_at FROM images WHERE gtin = ?",
+                                      (gtin,)).fetchone()
+
+    def _touch(self, gtin, digest, checked=False):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("UPDATE blobs SET used_at = ? WHERE digest = ?", (now, digest))
+            if checked:
+                self._conn.execute("UPDATE images SET checked_at = ? WHERE gtin = ?", (now, gtin))
+
+    def _store(self, gtin, url, data):
+        """Create the thumbnails of a downloaded image and return its digest."""
+        digest = hashlib.sha256(data).hexdigest()
+        if self._read(digest, THUMBNAIL_SIZES[0]) is None:
+            thumbnails = make_thumbnails(data)
+            os.makedirs(os.path.dirname(self._path(digest, 0)), exist_ok=True)
+            for size, thumbnail in thumbnails.items():
+                atomic_write(self._path(digest, size), thumbnail)
+            total = sum(len(thumbnail) for thumbnail in thumbnails.values())
+        else:
+            total = sum(os.path.getsize(self._path(digest, size)) for size in THUMBNAIL_SIZES)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?)", (digest, total, now))
+            self._conn.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?)", (gtin, url, digest, now))
+        self._evict()
+        return digest
+
+    def _evict(self):
+        """Delete the least recently used images beyond max_bytes."""
+        with self._lock:
+            digests = [digest for (digest,) in self._conn.execute(
+                "SELECT digest FROM (SELECT digest, sum(bytes) OVER (ORDER BY used_at DESC) AS total FROM blobs) "
+                "WHERE total > ?", (self.max_bytes,))]
+            for digest in digests:
+                self._conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+                self._conn.execute("DELETE FROM images WHERE digest = ?", (digest,))
+        for digest in digests:
+            for size in THUMBNAIL_SIZES:
+                try:
+                    os.remove(self._path(digest, size))
+                except FileNotFoundError:
+                    pass
+
+    def thumbnail(self, gtin, size=180):
+        """Return (digest, WebP bytes) of the product image of a GTIN scaled
+           to fit standard_size(size), or None if the product has no (usable) image.
+           Raises requests.RequestException if the image is not cached and
+           can't be downloaded."""
+        size = standard_size(size)
+        row = self._cached(gtin)
+        if row:
+            url, digest, checked_at = row
+            data = self._read(digest, size)
+            if data is not None and (self.gtin_cache.offline or time.time() - checked_at < self.ttl):
+                CACHE_LOOKUPS.inc("image", "hit")
+                self._touch(gtin, digest)
+                return digest, data
+        try:
+            product = self.gtin_cache.lookup(gtin)
+            url = product_image_url(product) if product else None
+            if url is None:
+                CACHE_LOOKUPS.inc("image", "miss")
+                return None
+            if row and row[0] == url and self._read(row[1], size) is not None:
+                # Same image as before
+                CACHE_LOOKUPS.inc("image", "hit")
+                self._touch(gtin, row[1], checked=True)
+                return row[1], self._read(row[1], size)
+            if self.gtin_cache.offline:
+                raise requests.ConnectionError("Offline and image not cached")
+            if self._failures.failed(gtin):
+                raise requests.ConnectionError("The image was not reachable just now")
+            response = session.get(url, timeout=10)
+            response.raise_for_status()
+        except requests.RequestException:
+            if row and self._read(row[1], size) is not None:
+                # Stale, but better than nothing
+                CACHE_LOOKUPS.inc("image", "stale")
+                return row[1], self._read(row[1], size)
+            CACHE_LOOKUPS.inc("image", "miss")
+            raise
+        CACHE_LOOKUPS.inc("image", "miss")
+        try:
+            digest = self._store(gtin, url, response.content)
+        except (OSError, Image.DecompressionBombError):
+            # Not an image Pillow can read
+            return None
+        data = self._read(digest, size)
+        return (digest, data) if data is not None else None
+
+    async def prefetch(self, gtin, size, fetch_product, fetch_image):
+        """Make sure the next thumbnail() of a GTIN is answered without
+           waiting for upstream, like GTINCache.prefetch(): the product and its
+           image are fetched with the coroutine functions `fetch_product`
+           (gtin -> product or None) and `fetch_image` (url -> bytes), both
+           raising requests.RequestException. Decoding, resizing and the
+           database run in worker threads."""
+        size = standard_size(size)
+        row = await asyncio.to_thread(self._cached, gtin)
+        cached = row is not None and os.path.exists(self._path(row[1], size))
+        if self.gtin_cache.offline or (cached and time.time() - row[2] < self.ttl):
+            return
+        product = await self.gtin_cache.prefetch(gtin, fetch_product)
+        url = product_image_url(product) if product else None
+        if url is None or (cached and row[0] == url):
+            return
+        try:
+            data = await fetch_image(url)
+        except requests.RequestException:
+            self._failures.add(gtin)
+            return
+        self._failures.discard(gtin)
+        try:
+            await asyncio.to_thread(self._store, gtin, url, data)
+        except (OSError, Image.DecompressionBombError):
+            # thumbnail() finds out again
+            pass
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_image_cache(directory, gtin_cache):
+    """Return the process-wide image cache for the given directory."""
+    directory = os.path.abspath(directory)
+    with _caches_lock:
+        if directory not in _caches:
+            _caches[directory] = ImageCache(directory, gtin_cache)
+        return _caches[directory]
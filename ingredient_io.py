@@ -0,0 +1,88 @@
+import csv
+import io
+import json
+
+# Columns of the CSV export: (header, path into the ingredient)
+CSV_COLUMNS = [
+    ("id", ("id",)),
+    ("name", ("name",)),
+    ("place", ("location", "place")),
+    ("shelf", ("location", "shelf")),
+    ("category", ("category",)),
+    ("source", ("source",)),
+    ("best_before_date", ("best_before_date",)),
+    ("vegan_level", ("vegan_level",)),
+    ("diet_level", ("diet_level",)),
+    ("size_value", ("size", "value")),
+    ("size_unit", ("size", "unit")),
+    ("price", ("price",)),
+    ("is_staple", ("is_staple",)),
+    ("energy", ("nutritional_values", "energy")),
+    ("fats_total", ("nutritional_values", "fats", "total")),
+    ("fats_saturated", ("nutritional_values", "fats", "saturated")),
+    ("carbohydrates_total", ("nutritional_values", "carbohydrates", "total")),
+    ("sugar", ("nutritional_values", "carbohydrates", "sugar")),
+    ("proteins", ("nutritional_values", "proteins")),
+    ("fiber", ("nutritional_values", "fiber")),
+    ("salt", ("nutritional_values", "salt")),
+    ("storage_conditions", ("storage_conditions",)),
+    ("allergenes", ("allergenes",)),
+    ("personal_distaste", ("personal_distaste",)),
+    ("synonyms", ("synonyms",)),
+    ("comment", ("comment",)),
+    ("image_url", ("image_url",)),
+]
+
+#------------------ IMPORT -----------------------------
+
+def read_jsonl(lines):
+    """Yield (line number, ingredient or None, error or None) for a JSONL stream.
+       Blank lines are skipped."""
+    for number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            try:
+                line = line.decode("utf-8")
+            except UnicodeDecodeError as e:
+                yield number, None, f"Invalid UTF-8: {e}"
+                continue
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line), None
+        except ValueError as e:
+            yield number, None, f"Invalid JSON: {e}"
+
+#------------------ EXPORT -----------------------------
+
+def _csv_value(ingredient, path):
+    value = ingredient
+    for key in path:
+        if not isinstance(value, dict):
+            return ""
+        value = value.get(key)
+    if isinstance(value, list):
+        return ", ".join(str(v) for v in value)
+    return "" if value is None else value
+
+def iter_jsonl(ingredients):
+    """Yield one JSON line per ingredient."""
+    for ingredient in ingredients:
+        yield json.dumps(ingredient, ensure_ascii=False) + "\n"
+
+def iter_csv(ingredients):
+    """Yield the CSV header and one CSV row per ingredient. List fields are
+       joined with ", " like in the GUI."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return text
+
+    writer.writerow([header for header, _ in CSV_COLUMNS])
+    yield flush()
+    for ingredient in ingredients:
+        writer.writerow([_csv_value(ingredient, path) for _, path in CSV_COLUMNS])
+        yield flush()
@@ -0,0 +1,724 @@
+import collections
+import contextlib
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+
+from bitset_index import BitsetIndex
+from expiry_index import ExpiryIndex, parse_best_before
+from facet_index import FacetIndex
+from file_lock import FileLock, atomic_write
+from metrics import (CACHE_LOOKUPS, FILE_READ_BYTES, FILE_READS, FILE_WRITE_BYTES, FILE_WRITES,
+                     STORE_LOAD_SECONDS, STORE_SAVE_SECONDS)
+from search_index import SearchIndex
+from serializer import EncodedCache, dumps, dumps_file, loads
+from suggest_index import SuggestIndex
+
+log = logging.getLogger(__name__)
+
+# Storage mode: "json" rewrites Ingredients.json on every change, "journal"
+# appends changes to a JSONL journal next to it and folds them in later,
+# "sqlite" keeps the database in Ingredients.db (see sqlite_store.py).
+STORAGE_MODE = os.environ.get("DABBA_STORAGE", "json")
+# When journal writes are fsync'ed: "always", "interval" or "never"
+FSYNC_POLICY = os.environ.get("DABBA_FSYNC", "interval")
+
+# Query parameters that GET /ingredients can filter on
+FILTER_FIELDS = ("place", "category", "source", "vegan_level", "diet_level", "allergene")
+# Query parameters of GET /ingredients for "safe for this guest" queries:
+# comma separated allergenes / personal distastes to exclude, and the
+# minimum vegan_level / maximum diet_level
+GUEST_FILTERS = ("exclude_allergens", "exclude_distaste", "min_vegan", "max_diet")
+# Keys GET /ingredients can sort by (prefix with "-" for descending order)
+SORT_FIELDS = ("name", "place", "shelf", "category", "source", "best_before_date",
+               "vegan_level", "diet_level", "price")
+
+#------------------ FUNCTIONS -----------------------------
+
+class ConflictError(Exception):
+    """The ingredient was changed since the client read it (ETag mismatch)."""
+
+def record_etag(ingredient):
+    """Return the version of an ingredient: a hash of its canonical JSON."""
+    data = json.dumps(ingredient, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+def check_etag(ingredient, if_match):
+    """Raise ConflictError unless the ingredient's ETag is one of `if_match`
+       (None means the client did not ask for a check)."""
+    if if_match is not None and record_etag(ingredient) not in if_match:
+        raise ConflictError("Ingredient was changed in the meantime")
+
+def matches_filters(ingredient, filters):
+    """Check whether an ingredient matches all the given filters."""
+    for key, value in filters.items():
+        if key == "place":
+            if ingredient.get("location", {}).get("place") != value:
+                return False
+        elif key == "allergene":
+            if value not in ingredient.get("allergenes", []):
+                return False
+        elif key in ("vegan_level", "diet_level"):
+            if str(ingredient.get(key)) != value:
+                return False
+        elif ingredient.get(key) != value:
+            return False
+    return True
+
+def _sort_value(ingredient, field):
+    """Return the value of a SORT_FIELDS key used to order ingredients."""
+    if field in ("place", "shelf"):
+        value = ingredient.get("location", {}).get(field)
+    elif field == "best_before_date":
+        value = parse_best_before(ingredient.get(field))
+    else:
+        value = ingredient.get(field)
+    return value.casefold() if isinstance(value, str) else value
+
+def sort_ingredients(ingredients, sort):
+    """Sort ingredients by a SORT_FIELDS key ("-key" for descending order).
+       Ingredients without a value always come last."""
+    field = sort.lstrip("-")
+    values = [(_sort_value(ing, field), ing) for ing in ingredients]
+    present = [item for item in values if item[0] is not None]
+    present.sort(key=lambda item: item[0], reverse=sort.startswith("-"))
+    return [ing for _, ing in present] + [ing for value, ing in values if value is None]
+
+def paginate(ingredients, sort=None, limit=None, offset=0):
+    """Sort and slice a list of ingredients. Returns (total, page)."""
+    if sort:
+        ingredients = sort_ingredients(ingredients, sort)
+    end = None if limit is None else offset + limit
+    return len(ingredients), ingredients[offset:end]
+
+def project(ingredient, fields):
+    """Return only the given fields of an ingredient. Nested fields can be
+       selected with a dot, e.g. "location.place"."""
+    result = {}
+    for field in fields:
+        *parents, last = field.split(".")
+        source, target = ingredient, result
+        for part in parents:
+            source = source.get(part)
+            if not isinstance(source, dict):
+                break
+            target = target.setdefault(part, {})
+        else:
+            if last in source:
+                target[last] = source[last]
+    return result
+
+def wait_seconds(timeout):
+    """Return a timeout for changes() that is safe to wait: negative, NaN
+       or infinite timeouts mean not waiting at all."""
+    return max(timeout, 0) if math.isfinite(timeout) else 0
+
+#------------------ STORE -----------------------------
+
+class IngredientStore:
+    """In-memory copy of the ingredients database.
+
+       The file is parsed once and kept in memory. It is only re-read when its
+       mtime or size changes, e.g. after Dabba_GUI.py saved it.
+       An id -> position index makes single-item reads and writes O(1).
+
+       In journal mode every change is appended as one line to a JSONL journal
+       instead of rewriting the whole file. The journal is replayed on top of
+       the snapshot when loading and compacted into a new snapshot in the
+       background.
+
+       Secondary indexes (e.g. the SearchIndex) are kept in sync through
+       their rebuild(ingredients), add(ingredient) and remove(ingredient)
+       methods, see add_index().
+
+       Writes are safe across processes (API workers, the GUI): every change
+       re-reads the file under an exclusive lock on <file>.lock, and the
+       snapshot is replaced atomically via a temporary file. update() and
+       delete() accept the ETags the client last saw (see record_etag())
+       and raise ConflictError if the ingredient changed since.
+
+       The JSON of every ingredient is cached (see EncodedCache), so list
+       responses do not encode unchanged ingredients again.
+
+       The last CHANGE_LOG_SIZE changes are kept as add/update/delete events
+       with a sequence number, including changes by other processes (found
+       by diffing on reload), see changes()."""
+
+    # Minimum number of seconds between two stat() calls on the file
+    CHECK_INTERVAL = 1.0
+    # Seconds between two fsync()s of the journal with the "interval" policy
+    FSYNC_INTERVAL = 1.0
+    # Number of journal entries after which the journal is compacted
+    COMPACT_THRESHOLD = 1000
+    # Number of change events kept for changes()
+    CHANGE_LOG_SIZE = 1000
+
+    def __init__(self, path, journal=False, fsync="interval"):
+        if fsync not in ("always", "interval", "never"):
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.path = path
+        self.journal_path = os.path.splitext(path)[0] + ".journal.jsonl" if journal else None
+        self.fsync = fsync
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(path + ".lock")
+        self._ingredients = []
+        self._positions = {}
+        self._sorted_cache = {}
+        self._indexes = []
+        self._signature = None
+        self._last_check = None
+        self._journal_offset = 0
+        self._journal_entries = 0
+        self._journal_dirty = False
+        # Change events; sequence numbers are only valid within this epoch
+        self._epoch = uuid.uuid4().hex[:12]
+        self._change_seq = 0
+        self._changes = collections.deque(maxlen=self.CHANGE_LOG_SIZE)
+        self._changed = threading.Condition(self._lock)
+        self._logging = True
+
+        self._search_index = SearchIndex()
+        self.add_index(self._search_index)
+        self._expiry_index = ExpiryIndex()
+        self.add_index(self._expiry_index)
+        self._facet_index = FacetIndex()
+        self.add_index(self._facet_index)
+        self._bitset_index = BitsetIndex()
+        self.add_index(self._bitset_index)
+        self._suggest_index = SuggestIndex()
+        self.add_index(self._suggest_index)
+        # Created on first use, so NumPy is only loaded when statistics or
+        # duplicates are asked for
+        self._column_index = None
+        self._duplicate_index = None
+        self._encoded_cache = EncodedCache()
+        self.add_index(self._encoded_cache)
+
+        if self.journal_path:
+            self._stop = threading.Event()
+            worker = threading.Thread(target=self._background, name="journal-worker", daemon=True)
+            worker.start()
+
+    def add_index(self, index):
+        """Register a secondary index and fill it with the current ingredients."""
+        with self._lock:
+            self._indexes.append(index)
+            index.rebuild(self._ingredients)
+
+    def _file_signature(self, path):
+        """Return (mtime, size, inode) of a file, or None if it is missing.
+           The inode changes whenever the file is atomically replaced."""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def _current_signature(self):
+        """Return the signature of the database file (and journal) on disk."""
+        if self.journal_path:
+            return (self._file_signature(self.path), self._file_signature(self.journal_path))
+        return self._file_signature(self.path)
+
+    def refresh(self, force=False):
+        """Reload the database if the file changed since it was last read."""
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._last_check is not None and now - self._last_check < self.CHECK_INTERVAL:
+                return
+            self._last_check = now
+
+            signature = self._current_signature()
+            if signature == self._signature:
+                return
+            if (self.journal_path and self._signature is not None
+                    and signature[0] == self._signature[0]
+                    and signature[1] is not None and signature[1][1] >= self._journal_offset):
+                # Only the journal grew (another process appended to it)
+                self._replay_journal(self._journal_offset)
+            elif not self._load():
+                return
+            self._signature = signature
+
+    def _load(self):
+        """Read the snapshot (and replay the journal). Returns False if the file
+           could not be parsed."""
+        ingredients = []
+        if os.path.exists(self.path):
+            try:
+                with STORE_LOAD_SECONDS.time(), open(self.path, "rb") as f:
+                    data = f.read()
+                    ingredients = loads(data)
+                FILE_READS.inc("snapshot")
+                FILE_READ_BYTES.inc("snapshot", amount=len(data))
+            except ValueError:
+                # Half-written file (e.g. another process is saving). Keep the
+                # current data and try again on the next check.
+                return False
+        previous = self._ingredients
+        self._logging = False
+        try:
+            self._set_ingredients(ingredients)
+            if self.journal_path:
+                self._journal_entries = 0
+                self._replay_journal(0)
+        finally:
+            self._logging = True
+        if self._signature is not None:
+            self._log_differences(previous)
+        return True
+
+    def _log_differences(self, previous):
+        """Log the changes between an old list of ingredients and the current one."""
+        old = {ing["id"]: ing for ing in previous}
+        for ingredient in self._ingredients:
+            before = old.pop(ingredient["id"], None)
+            if before is None:
+                self._log_change("add", ingredient)
+            elif before != ingredient:
+                self._log_change("update", ingredient)
+        for id in old:
+            self._log_change("delete", {"id": id})
+
+    def _log_change(self, op, ingredient):
+        """Add an event to the change log and wake up waiting changes() calls."""
+        if not self._logging:
+            return
+        self._change_seq += 1
+        event = {"seq": self._change_seq, "op": op, "id": ingredient["id"]}
+        if op != "delete":
+            event["ingredient"] = ingredient
+        self._changes.append(event)
+        self._changed.notify_all()
+
+    def _set_ingredients(self, ingredients):
+        """Replace the whole database. The indexes are updated with just the
+           ingredients that differ from the current ones (after another
+           process saved, usually a few), or rebuilt if most of them do."""
+        current = {ing["id"]: ing for ing in self._ingredients}
+        removed, added = [], []
+        for ingredient in ingredients:
+            before = current.pop(ingredient["id"], None)
+            if before != ingredient:
+                if before is not None:
+                    removed.append(before)
+                added.append(ingredient)
+        removed.extend(current.values())
+        self._ingredients = ingredients
+        self._positions = {ing["id"]: i for i, ing in enumerate(ingredients)}
+        self._sorted_cache.clear()
+        if len(added) + len(removed) > len(ingredients) // 2:
+            for index in self._indexes:
+                index.rebuild(ingredients)
+            return
+        for index in self._indexes:
+            for ingredient in removed:
+                index.remove(ingredient)
+            for ingredient in added:
+                index.add(ingredient)
+
+    def _replay_journal(self, offset):
+        """Apply all complete journal entries starting at the given byte offset."""
+        try:
+            with open(self.journal_path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            self._journal_offset = 0
+            return
+        FILE_READS.inc("journal")
+        FILE_READ_BYTES.inc("journal", amount=len(data))
+        # A crash during an append can leave an incomplete last line; it is
+        # ignored until it is completed.
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            try:
+                entry = loads(line)
+            except ValueError:
+                continue
+            if entry["op"] == "put":
+                self._put(entry["record"], entry.get("id"))
+            elif entry["op"] == "delete":
+                self._remove(entry["id"])
+            self._journal_entries += 1
+        self._journal_offset = offset + end
+
+    def _put(self, ingredient, id=None):
+        """Insert or replace an ingredient in memory. `id` is the ID it was
+           stored under before, if it changed."""
+        self._sorted_cache.clear()
+        new_id = ingredient["id"]
+        pos = self._positions.get(id if id is not None else new_id)
+        if pos is None:
+            pos = self._positions.get(new_id)
+        if pos is None:
+            self._positions[new_id] = len(self._ingredients)
+            self._ingredients.append(ingredient)
+            self._log_change("add", ingredient)
+        else:
+            old = self._ingredients[pos]
+            if old["id"] != new_id:
+                del self._positions[old["id"]]
+                self._positions[new_id] = pos
+                # For clients the renamed ingredient is a new one
+                self._log_change("delete", old)
+                self._log_change("add", ingredient)
+            else:
+                self._log_change("update", ingredient)
+            self._ingredients[pos] = ingredient
+            for index in self._indexes:
+                index.remove(old)
+        for index in self._indexes:
+            index.add(ingredient)
+
+    def _remove(self, id):
+        """Remove an ingredient from memory. Returns False if it does not exist."""
+        pos = self._positions.pop(id, None)
+        if pos is None:
+            return False
+        self._sorted_cache.clear()
+        for index in self._indexes:
+            index.remove(self._ingredients[pos])
+        # Move the last ingredient into the freed slot so no other
+        # position has to change.
+        last = self._ingredients.pop()
+        if pos < len(self._ingredients):
+            self._ingredients[pos] = last
+            self._positions[last["id"]] = pos
+        self._log_change("delete", {"id": id})
+        return True
+
+    def _commit(self, *entries):
+        """Persist changes that were already applied in memory."""
+        if not self.journal_path:
+            self._save()
+            return
+        line = b"".join(dumps(entry) + b"\n" for entry in entries)
+        with STORE_SAVE_SECONDS.time(), open(self.journal_path, "a+b") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell():
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    # Terminate an incomplete line left behind by a crash
+                    line = b"\n" + line
+            f.write(line)
+            f.flush()
+            FILE_WRITES.inc("journal")
+            FILE_WRITE_BYTES.inc("journal", amount=len(line))
+            if self.fsync == "always":
+                os.fsync(f.fileno())
+            self._journal_offset = f.tell()
+        self._journal_dirty = self.fsync == "interval"
+        self._journal_entries += len(entries)
+        self._signature = self._current_signature()
+
+    def _save(self):
+        """Write the in-memory database back to the file (atomically)."""
+        with STORE_SAVE_SECONDS.time():
+            data = dumps_file(self._ingredients)
+            atomic_write(self.path, data)
+        FILE_WRITES.inc("snapshot")
+        FILE_WRITE_BYTES.inc("snapshot", amount=len(data))
+        self._signature = self._current_signature()
+
+    @contextlib.contextmanager
+    def _writing(self):
+        """Hold the thread and process locks and bring the data up to date,
+           so a change is never based on stale data."""
+        with self._lock, self._file_lock:
+            self.refresh(force=True)
+            yield
+
+    def version(self):
+        """Return (version, modified): a token that changes with every change
+           of the data, also when made by another process, and the time of
+           the last change in seconds since the epoch."""
+        with self._lock:
+            self.refresh()
+            signature = self._signature
+        files = [sig for sig in (signature if self.journal_path else (signature,)) if sig]
+        version = hashlib.sha1(repr(signature).encode()).hexdigest()[:16]
+        return version, max((sig[0] for sig in files), default=0) / 1e9
+
+    def disk_usage(self):
+        """Return the size of the database files in bytes."""
+        files = [self.path, self.journal_path] if self.journal_path else [self.path]
+        return sum(os.path.getsize(path) for path in files if os.path.exists(path))
+
+    def all(self):
+        """Return all ingredients."""
+        self.refresh()
+        return self._ingredients
+
+    def get(self, id):
+        """Return the ingredient with the given ID, or None."""
+        with self._lock:
+            self.refresh()
+            pos = self._positions.get(id)
+            return self._ingredients[pos] if pos is not None else None
+
+    def query(self, filters=None, sort=None, limit=None, offset=0):
+        """Return (total, page) of the ingredients matching the given filters
+           (see FILTER_FIELDS and GUEST_FILTERS), ordered by a SORT_FIELDS key."""
+        filters = dict(filters or {})
+        guest = {key: filters.pop(key) for key in GUEST_FILTERS if key in filters}
+        with self._lock:
+            self.refresh()
+            if guest:
+                # Candidates from the bitsets, in storage order like below
+                positions = sorted(self._positions[id] for id in self._bitset_index.match(**guest))
+                ingredients = [self._ingredients[pos] for pos in positions]
+                if sort:
+                    ingredients = sort_ingredients(ingredients, sort)
+            elif sort:
+                # Sorted orders are cached until the next change
+                if sort not in self._sorted_cache:
+                    CACHE_LOOKUPS.inc("sorted", "miss")
+                    self._sorted_cache[sort] = sort_ingredients(self._ingredients, sort)
+                else:
+                    CACHE_LOOKUPS.inc("sorted", "hit")
+                ingredients = self._sorted_cache[sort]
+            else:
+                ingredients = self._ingredients
+            if filters:
+                ingredients = [ing for ing in ingredients if matches_filters(ing, filters)]
+            return paginate(ingredients, limit=limit, offset=offset)
+
+    def search(self, query):
+        """Return ingredients matching the query, best matches first
+           (see SearchIndex)."""
+        with self._lock:
+            self.refresh()
+            return [self._ingredients[self._positions[id]] for id in self._search_index.search(query)]
+
+    def suggest(self, field, prefix, limit=10):
+        """Return completions of a prefix for one of the SUGGEST_FIELDS
+           (see SuggestIndex.suggest())."""
+        with self._lock:
+            self.refresh()
+            return self._suggest_index.suggest(field, prefix, limit)
+
+    def encode(self, ingredients):
+        """Return the JSON array (bytes) of ingredients returned by this store,
+           joined from cached per-record JSON."""
+        with self._lock:
+            return self._encoded_cache.encode_list(ingredients)
+
+    def changes(self, since=None, timeout=0):
+        """Return (cursor, events) with the change events after the cursor
+           `since` (None: only return the current cursor). Waits up to
+           `timeout` seconds for a change, also checking the file for changes
+           by other processes. events is None if the changes since then are
+           not known anymore (too old, or the cursor is from another process);
+           the client then has to reload everything."""
+        deadline = time.monotonic() + wait_seconds(timeout)
+        with self._lock:
+            while True:
+                self.refresh()
+                cursor = f"{self._epoch}:{self._change_seq}"
+                if since is None:
+                    return cursor, []
+                epoch, _, seq = since.partition(":")
+                if epoch != self._epoch or not (seq.isascii() and seq.isdigit()) or int(seq) > self._change_seq:
+                    return cursor, None
+                if int(seq) < self._change_seq - len(self._changes):
+                    return cursor, None
+                if int(seq) < self._change_seq:
+                    return cursor, [event for event in self._changes if event["seq"] > int(seq)]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return cursor, []
+                self._changed.wait(min(remaining, self.CHECK_INTERVAL))
+
+    def facets(self, names=None):
+        """Return {facet: {value: count}} for the given FACET_FIELDS (default all)."""
+        with self._lock:
+            self.refresh()
+            return self._facet_index.facets(names)
+
+    def stats(self, fields=None, group_by=None, filters=None):
+        """Return statistics of numeric fields, see ColumnIndex.stats()."""
+        with self._lock:
+            self.refresh()
+            if self._column_index is None:
+                from column_index import ColumnIndex
+                self._column_index = ColumnIndex()
+                self.add_index(self._column_index)
+            return self._column_index.stats(fields, group_by, filters)
+
+    def _duplicates(self):
+        if self._duplicate_index is None:
+            from duplicate_index import DuplicateIndex
+            self._duplicate_index = DuplicateIndex()
+            self.add_index(self._duplicate_index)
+        return self._duplicate_index
+
+    def similar(self, ingredient, threshold=None):
+        """Return [(ingredient, similarity)] of stored ingredients that are
+           probable duplicates of the given one (see DuplicateIndex.similar())."""
+        with self._lock:
+            self.refresh()
+            index = self._duplicates()
+            matches = index.similar(ingredient) if threshold is None else index.similar(ingredient, threshold)
+            return [(self._ingredients[self._positions[id]], similarity) for id, similarity in matches]
+
+    def duplicates(self, threshold=None):
+        """Return groups of probable duplicates as [(ingredients, similarity)]
+           (see DuplicateIndex.duplicates())."""
+        with self._lock:
+            self.refresh()
+            index = self._duplicates()
+            groups = index.duplicates() if threshold is None else index.duplicates(threshold)
+            return [([self._ingredients[self._positions[id]] for id in ids], similarity)
+                    for ids, similarity in groups]
+
+    def expiring(self, start, end, filters=None):
+        """Return the ingredients whose best before date is between start and
+           end (dates, None for an open range), soonest first."""
+        with self._lock:
+            self.refresh()
+            ingredients = (self._ingredients[self._positions[id]] for id in self._expiry_index.between(start, end))
+            return [ing for ing in ingredients if matches_filters(ing, filters or {})]
+
+    def add(self, ingredient):
+        """Add a new ingredient. Returns False if the ID already exists."""
+        with self._writing():
+            if ingredient["id"] in self._positions:
+                return False
+            self._put(ingredient)
+            self._commit({"op": "put", "record": ingredient})
+            return True
+
+    def add_many(self, ingredients):
+        """Add several ingredients with a single write. Returns the IDs that
+           were skipped because they already exist."""
+        with self._writing():
+            added, skipped = [], []
+            for ingredient in ingredients:
+                if ingredient["id"] in self._positions:
+                    skipped.append(ingredient["id"])
+                    continue
+                self._put(ingredient)
+                added.append(ingredient)
+            if added:
+                self._commit(*({"op": "put", "record": ingredient} for ingredient in added))
+            return skipped
+
+    def iter_all(self):
+        """Iterate over a snapshot of all ingredients (for streaming exports)."""
+        with self._lock:
+            self.refresh()
+            ingredients = list(self._ingredients)
+        yield from ingredients
+
+    def update(self, id, ingredient, if_match=None):
+        """Replace the ingredient with the given ID. Returns False if it does not exist.
+           Raises ValueError if the new ID is already used by another ingredient
+           and ConflictError if its ETag is not in `if_match`."""
+        with self._writing():
+            if id not in self._positions:
+                return False
+            check_etag(self._ingredients[self._positions[id]], if_match)
+            if ingredient["id"] != id and ingredient["id"] in self._positions:
+                raise ValueError("Ingredient with this ID already exists")
+            self._put(ingredient, id)
+            self._commit({"op": "put", "id": id, "record": ingredient})
+            return True
+
+    def delete(self, id, if_match=None):
+        """Delete the ingredient with the given ID. Returns False if it does not exist.
+           Raises ConflictError if its ETag is not in `if_match`."""
+        with self._writing():
+            if id in self._positions:
+                check_etag(self._ingredients[self._positions[id]], if_match)
+            if not self._remove(id):
+                return False
+            self._commit({"op": "delete", "id": id})
+            return True
+
+    #------------------ JOURNAL -----------------------------
+
+    def compact(self):
+        """Fold the journal into a new snapshot.
+
+           The snapshot is written to a temporary file and atomically renamed
+           over Ingredients.json, so a crash never leaves a truncated database.
+           Changes made while the snapshot is written stay in the journal;
+           other processes are only locked out while the files are swapped."""
+        with self._writing():
+            if not self._journal_entries:
+                return
+            ingredients = list(self._ingredients)
+            offset = self._journal_offset
+            snapshot_signature = self._signature[0]
+
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        data = dumps_file(ingredients)
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        FILE_WRITES.inc("snapshot")
+        FILE_WRITE_BYTES.inc("snapshot", amount=len(data))
+
+        with self._lock, self._file_lock:
+            if self._file_signature(self.path) != snapshot_signature:
+                # Someone else replaced the snapshot in the meantime
+                os.remove(tmp_path)
+                return
+            with open(self.journal_path, "rb") as f:
+                f.seek(offset)
+                tail = f.read()
+            os.replace(tmp_path, self.path)
+            # Keep only the entries that are not part of the new snapshot
+            atomic_write(self.journal_path, tail)
+            self._journal_offset = len(tail)
+            self._journal_entries = tail.count(b"\n")
+            self._journal_dirty = False
+            self._signature = self._current_signature()
+
+    def _background(self):
+        """Periodically fsync the journal and compact it when it gets long."""
+        while not self._stop.wait(self.FSYNC_INTERVAL):
+            try:
+                if self._journal_dirty:
+                    with self._lock:
+                        with open(self.journal_path, "ab") as f:
+                            os.fsync(f.fileno())
+                        self._journal_dirty = False
+                if self._journal_entries >= self.COMPACT_THRESHOLD:
+                    self.compact()
+            except OSError as e:
+                log.error("Journal maintenance failed: %s", e)
+
+    def close(self):
+        """Stop the journal worker and flush pending journal writes."""
+        if self.journal_path:
+            self._stop.set()
+            with self._lock:
+                if self._journal_dirty and os.path.exists(self.journal_path):
+                    with open(self.journal_path, "ab") as f:
+                        os.fsync(f.fileno())
+                    self._journal_dirty = False
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_store(path):
+    """Return the process-wide store for the given database file.
+       With DABBA_STORAGE=sqlite the database is Ingredients.db next to it."""
+    path = os.path.abspath(path)
+    with _stores_lock:
+        if path not in _stores:
+            if STORAGE_MODE == "sqlite":
+                from sqlite_store import SQLiteIngredientStore
+                _stores[path] = SQLiteIngredientStore(os.path.splitext(path)[0] + ".db")
+            else:
+                _stores[path] = IngredientStore(path, journal=STORAGE_MODE == "journal", fsync=FSYNC_POLICY)
+        return _stores[path]
@@ -0,0 +1,134 @@
+import bisect
+import threading
+import time
+
+# Default histogram buckets in seconds (upper bounds)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+#------------------ METRICS -----------------------------
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """A value that only goes up, one per combination of label values."""
+
+    type = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _labels(self.labels, key), value) for key, value in sorted(self._values.items())]
+
+class Gauge:
+    """A value read from a function when the metrics are collected."""
+
+    type = "gauge"
+
+    def __init__(self, name, help, function):
+        self.name = name
+        self.help = help
+        self.function = function
+        REGISTRY.append(self)
+
+    def samples(self):
+        return [(self.name, "", self.function())]
+
+class Histogram:
+    """Distribution of durations (or sizes) in cumulative buckets."""
+
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}   # label values -> [count per bucket (+Inf last), sum]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][i] += 1
+            entry[1] += value
+
+    def time(self, *labels):
+        """Context manager observing the duration of a block."""
+        return _Timer(self, labels)
+
+    def samples(self):
+        result = []
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = bound if isinstance(bound, str) else _number(float(bound))
+                result.append((self.name + "_bucket", _labels(self.labels + ("le",), key + (le,)), cumulative))
+            result.append((self.name + "_sum", _labels(self.labels, key), total))
+            result.append((self.name + "_count", _labels(self.labels, key), cumulative))
+        return result
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+REGISTRY = []
+
+def render():
+    """Return all metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{labels} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+#------------------ SHARED METRICS -----------------------------
+
+# Reads and writes of the database files; `file` is snapshot, journal or sqlite
+FILE_READS = Counter("dabba_file_reads_total", "Database file reads.", ["file"])
+FILE_READ_BYTES = Counter("dabba_file_read_bytes_total", "Bytes read from database files.", ["file"])
+FILE_WRITES = Counter("dabba_file_writes_total", "Database file writes.", ["file"])
+FILE_WRITE_BYTES = Counter("dabba_file_written_bytes_total", "Bytes written to database files.", ["file"])
+STORE_LOAD_SECONDS = Histogram("dabba_store_load_seconds", "Time to (re)load the database into memory.")
+STORE_SAVE_SECONDS = Histogram("dabba_store_save_seconds", "Time to persist a change.")
+VALIDATION_SECONDS = Histogram("dabba_validation_seconds", "Time to validate an ingredient against the schema.")
+# `cache` is gtin, image, sorted or schema; `result` is hit, miss or stale
+CACHE_LOOKUPS = Counter("dabba_cache_lookups_total", "Cache lookups by result.", ["cache", "result"])
@@ -0,0 +1,84 @@
+import json
+import os
+import threading
+import time
+
+from jsonschema import FormatChecker
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
+
+from ingredient_store import parse_best_before
+from metrics import CACHE_LOOKUPS, VALIDATION_SECONDS
+
+#------------------ VALIDATOR -----------------------------
+
+def is_date(value):
+    """Format check for "date": DD.MM.YYYY or YYYY-MM-DD (empty means no date)."""
+    if not isinstance(value, str) or value == "":
+        return True
+    return parse_best_before(value) is not None
+
+class SchemaValidator:
+    """Validates ingredients against Ingredient_Schema.json.
+
+       The schema is loaded and compiled into a jsonschema validator once and
+       only recompiled when the schema file changes. The "date" format of
+       best_before_date is checked, accepting DD.MM.YYYY (GUI) as well as
+       YYYY-MM-DD (web form)."""
+
+    # Minimum number of seconds between two stat() calls on the schema file
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._validator = None
+        self._signature = None
+        self._last_check = None
+
+    def _compile(self):
+        """Return the compiled validator, recompiling it if the schema changed."""
+        with self._lock:
+            now = time.monotonic()
+            if self._validator is not None and now - self._last_check < self.CHECK_INTERVAL:
+                CACHE_LOOKUPS.inc("schema", "hit")
+                return self._validator
+            self._last_check = now
+
+            stat = os.stat(self.path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+            CACHE_LOOKUPS.inc("schema", "hit" if signature == self._signature else "miss")
+            if signature != self._signature:
+                with open(self.path, "r") as f:
+                    schema = json.load(f)
+                cls = validator_for(schema)
+                cls.check_schema(schema)
+
+                format_checker = FormatChecker()
+                format_checker.checks("date")(is_date)
+                self._validator = cls(schema, format_checker=format_checker)
+                self._signature = signature
+            return self._validator
+
+    def preload(self):
+        """Load and compile the schema now instead of on the first validate()."""
+        self._compile()
+
+    def validate(self, ingredient):
+        """Raise jsonschema.ValidationError if the ingredient is invalid."""
+        with VALIDATION_SECONDS.time():
+            error = best_match(self._compile().iter_errors(ingredient))
+        if error is not None:
+            raise error
+
+
+_validators = {}
+_validators_lock = threading.Lock()
+
+def get_validator(path):
+    """Return the process-wide validator for the given schema file."""
+    path = os.path.abspath(path)
+    with _validators_lock:
+        if path not in _validators:
+            _validators[path] = SchemaValidator(path)
+        return _validators[path]
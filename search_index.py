@@ -0,0 +1,131 @@
+import bisect
+import re
+import unicodedata
+
+# Fields that are searched and how much a match in them counts
+SEARCH_FIELDS = {
+    "name": 3.0,
+    "synonyms": 2.0,
+    "category": 1.5,
+    "source": 1.0,
+    "storage_conditions": 1.0,
+    "comment": 0.5,
+}
+
+# Score factor for an exact token match, a token prefix and a substring
+EXACT, PREFIX, INFIX = 1.0, 0.6, 0.3
+
+GERMAN_UMLAUTS = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue"})
+
+#------------------ FUNCTIONS -----------------------------
+
+def fold(text):
+    """Lowercase text and strip diacritics ("Gewürz" -> "gewurz")."""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+def tokenize(text):
+    """Split text into folded tokens. Words with umlauts are also indexed in
+       their transliterated form, so "gewuerz" finds "Gewürz" as well."""
+    tokens = re.findall(r"\w+", fold(text))
+    tokens += [t for t in re.findall(r"\w+", text.casefold().translate(GERMAN_UMLAUTS)) if t not in tokens]
+    return tokens
+
+def field_text(ingredient, field):
+    """Return the searchable text of a field (lists are joined)."""
+    value = ingredient.get(field)
+    if isinstance(value, list):
+        return " ".join(str(v) for v in value)
+    return str(value) if value is not None else ""
+
+def trigrams(token):
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+#------------------ INDEX -----------------------------
+
+class SearchIndex:
+    """Inverted index over the SEARCH_FIELDS of all ingredients.
+
+       Query tokens match indexed tokens exactly, as a prefix or - for German
+       compounds like "Curryketchup" - as a substring via a trigram index.
+       The index is updated incrementally when ingredients change."""
+
+    def __init__(self):
+        self._postings = {}     # token -> {id: weight}
+        self._tokens = []       # sorted list of all tokens, for prefix lookups
+        self._trigrams = {}     # trigram -> set of tokens
+        self._documents = {}    # id -> {token: weight}
+
+    def rebuild(self, ingredients):
+        """Index all ingredients from scratch."""
+        self.__init__()
+        for ingredient in ingredients:
+            self.add(ingredient)
+
+    def add(self, ingredient):
+        """Index an ingredient."""
+        weights = {}
+        for field, weight in SEARCH_FIELDS.items():
+            for token in tokenize(field_text(ingredient, field)):
+                weights[token] = max(weights.get(token, 0), weight)
+        id = ingredient["id"]
+        self._documents[id] = weights
+        for token, weight in weights.items():
+            if token not in self._postings:
+                self._postings[token] = {}
+                bisect.insort(self._tokens, token)
+                for trigram in trigrams(token):
+                    self._trigrams.setdefault(trigram, set()).add(token)
+            self._postings[token][id] = weight
+
+    def remove(self, ingredient):
+        """Remove an ingredient from the index."""
+        for token in self._documents.pop(ingredient["id"], {}):
+            postings = self._postings[token]
+            del postings[ingredient["id"]]
+            if not postings:
+                del self._postings[token]
+                del self._tokens[bisect.bisect_left(self._tokens, token)]
+                for trigram in trigrams(token):
+                    self._trigrams[trigram].discard(token)
+                    if not self._trigrams[trigram]:
+                        del self._trigrams[trigram]
+
+    def _matches(self, query_token):
+        """Return {token: factor} for all indexed tokens matching a query token."""
+        matches = {}
+        if len(query_token) >= 3:
+            # Substring: all tokens containing every trigram of the query token
+            grams = sorted(trigrams(query_token), key=lambda g: len(self._trigrams.get(g, ())))
+            candidates = set(self._trigrams.get(grams[0], ()))
+            for gram in grams[1:]:
+                candidates &= self._trigrams.get(gram, set())
+            for token in candidates:
+                if query_token in token:
+                    matches[token] = INFIX
+        i = bisect.bisect_left(self._tokens, query_token)
+        while i < len(self._tokens) and self._tokens[i].startswith(query_token):
+            token = self._tokens[i]
+            matches[token] = EXACT if token == query_token else PREFIX
+            i += 1
+        return matches
+
+    def search(self, query):
+        """Return the IDs of ingredients matching every word of the query,
+           best matches first."""
+        words = re.findall(r"\w+", fold(query))
+        if not words:
+            return []
+        scores = None
+        for word in words:
+            word_scores = {}
+            for token, factor in self._matches(word).items():
+                for id, weight in self._postings[token].items():
+                    word_scores[id] = max(word_scores.get(id, 0), weight * factor)
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = {id: score + word_scores[id] for id, score in scores.items() if id in word_scores}
+            if not scores:
+                return []
+        return sorted(scores, key=lambda id: -scores[id])
@@ -0,0 +1,90 @@
+import codecs
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Layout of Ingredients.json: "pretty" (indented, easy to read and diff) or
+# "compact" (one line, smaller and faster to write)
+FILE_FORMAT = os.environ.get("DABBA_JSON_FORMAT", "pretty")
+
+
+#------------------ FUNCTIONS -----------------------------
+
+def dumps(obj, sort_keys=False, default=None):
+    """Return obj as compact UTF-8 encoded JSON, using orjson if installed."""
+    if orjson:
+        # Like the json module, accept int keys (e.g. shelf numbers in facets)
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(obj, default=default, option=option)
+    return json.dumps(obj, sort_keys=sort_keys, default=default, separators=(",", ":"),
+                      ensure_ascii=False).encode("utf-8")
+
+def dumps_file(obj, format=None):
+    """Return obj encoded for the database file in the given (default
+       FILE_FORMAT) format. "pretty" is indented and escaped like
+       json.dumps(obj, indent=4) with or without orjson, so installing it
+       doesn't rewrite the whole file."""
+    format = format or FILE_FORMAT
+    if format == "compact":
+        return dumps(obj)
+    if format != "pretty":
+        raise ValueError(f"Unknown JSON format: {format}")
+    if orjson:
+        data = _double_indent(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+        return data.decode("utf-8").encode("ascii", "json-escape")
+    return json.dumps(obj, indent=4).encode("ascii")
+
+def _double_indent(data):
+    """Turn the 2 space indentation of orjson into 4 spaces. \x01 marks
+       indentation on the way; it can't occur in JSON unescaped, and neither
+       can a newline inside a string."""
+    data = data.replace(b"\n  ", b"\n\x01")
+    while b"\x01  " in data:
+        data = data.replace(b"\x01  ", b"\x01\x01")
+    return data.replace(b"\x01", b"    ")
+
+def _json_escape(error):
+    """Encoding error handler writing characters as JSON \\u escapes."""
+    return json.dumps(error.object[error.start:error.end])[1:-1], error.end
+
+codecs.register_error("json-escape", _json_escape)
+
+def loads(data):
+    """Parse JSON from bytes or str."""
+    return orjson.loads(data) if orjson else json.loads(data)
+
+#------------------ RECORD CACHE -----------------------------
+
+class EncodedCache:
+    """Pre-encoded JSON of every ingredient, so a list response is assembled
+       by joining bytes instead of encoding every record again. Records are
+       encoded on first use and dropped when the ingredient changes. Entries
+       remember the dict they were made from, so a record that was replaced
+       in the meantime is never answered from the cache."""
+
+    def __init__(self):
+        self._encoded = {}      # id -> (ingredient, bytes)
+
+    def rebuild(self, ingredients):
+        self._encoded.clear()
+
+    def add(self, ingredient):
+        pass
+
+    def remove(self, ingredient):
+        self._encoded.pop(ingredient["id"], None)
+
+    def encode(self, ingredient):
+        """Return the JSON of one ingredient."""
+        entry = self._encoded.get(ingredient["id"])
+        if entry is None or entry[0] is not ingredient:
+            entry = self._encoded[ingredient["id"]] = (ingredient, dumps(ingredient))
+        return entry[1]
+
+    def encode_list(self, ingredients):
+        """Return the JSON array of the given ingredients."""
+        return b"[" + b",".join([self.encode(ing) for ing in ingredients]) + b"]"
@@ -0,0 +1,574 @@
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from bitset_index import normalize
+from column_index import STAT_FIELDS
+from duplicate_index import DuplicateIndex
+from facet_index import FACET_FIELDS, facet_sort_key
+from ingredient_store import IngredientStore, check_etag, parse_best_before, wait_seconds
+from metrics import FILE_WRITES, STORE_SAVE_SECONDS
+from search_index import SEARCH_FIELDS, field_text, fold, tokenize
+from serializer import dumps, loads
+from suggest_index import SuggestIndex
+
+# List fields that are stored in the ingredient_values side table
+LIST_FIELDS = ("allergenes", "storage_conditions", "personal_distaste", "synonyms")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ingredients (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    place TEXT,
+    shelf INTEGER,
+    category TEXT,
+    source TEXT,
+    best_before TEXT,       -- ISO date (YYYY-MM-DD) so it sorts and compares
+    vegan_level INTEGER,
+    diet_level INTEGER,
+    search_text TEXT,       -- folded text of all SEARCH_FIELDS, for substring search
+    data TEXT NOT NULL      -- the full ingredient as JSON
+);
+CREATE INDEX IF NOT EXISTS idx_ingredients_name ON ingredients(name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_ingredients_place ON ingredients(place);
+CREATE INDEX IF NOT EXISTS idx_ingredients_category ON ingredients(category);
+CREATE INDEX IF NOT EXISTS idx_ingredients_source ON ingredients(source);
+CREATE INDEX IF NOT EXISTS idx_ingredients_best_before ON ingredients(best_before);
+CREATE INDEX IF NOT EXISTS idx_ingredients_vegan_level ON ingredients(vegan_level);
+CREATE INDEX IF NOT EXISTS idx_ingredients_diet_level ON ingredients(diet_level);
+
+CREATE TABLE IF NOT EXISTS ingredient_values (
+    ingredient_id TEXT NOT NULL REFERENCES ingredients(id) ON DELETE CASCADE ON UPDATE CASCADE,
+    field TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (field, value, ingredient_id)
+);
+CREATE INDEX IF NOT EXISTS idx_ingredient_values_id ON ingredient_values(ingredient_id);
+
+-- Bumped by every change, for ETags and Last-Modified of the REST API
+CREATE TABLE IF NOT EXISTS db_version (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    version INTEGER NOT NULL,
+    modified_at REAL NOT NULL   -- seconds since the epoch
+);
+INSERT OR IGNORE INTO db_version VALUES (0, 0, (julianday('now') - 2440587.5) * 86400.0);
+CREATE TRIGGER IF NOT EXISTS ingredients_insert_version AFTER INSERT ON ingredients BEGIN
+    UPDATE db_version SET version = version + 1, modified_at = (julianday('now') - 2440587.5) * 86400.0;
+END;
+CREATE TRIGGER IF NOT EXISTS ingredients_update_version AFTER UPDATE ON ingredients BEGIN
+    UPDATE db_version SET version = version + 1, modified_at = (julianday('now') - 2440587.5) * 86400.0;
+END;
+CREATE TRIGGER IF NOT EXISTS ingredients_delete_version AFTER DELETE ON ingredients BEGIN
+    UPDATE db_version SET version = version + 1, modified_at = (julianday('now') - 2440587.5) * 86400.0;
+END;
+
+-- Change feed: one row per added, updated or deleted ingredient (renames
+-- are a delete and an add); only the last 10000 changes are kept
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    op TEXT NOT NULL,
+    ingredient_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+INSERT OR IGNORE INTO meta VALUES ('epoch', lower(hex(randomblob(6))));
+CREATE TRIGGER IF NOT EXISTS ingredients_insert_change AFTER INSERT ON ingredients BEGIN
+    INSERT INTO changes (op, ingredient_id) VALUES ('add', NEW.id);
+END;
+CREATE TRIGGER IF NOT EXISTS ingredients_update_change AFTER UPDATE ON ingredients WHEN OLD.id = NEW.id BEGIN
+    INSERT INTO changes (op, ingredient_id) VALUES ('update', NEW.id);
+END;
+CREATE TRIGGER IF NOT EXISTS ingredients_rename_change AFTER UPDATE ON ingredients WHEN OLD.id != NEW.id BEGIN
+    INSERT INTO changes (op, ingredient_id) VALUES ('delete', OLD.id), ('add', NEW.id);
+END;
+CREATE TRIGGER IF NOT EXISTS ingredients_delete_change AFTER DELETE ON ingredients BEGIN
+    INSERT INTO changes (op, ingredient_id) VALUES ('delete', OLD.id);
+END;
+CREATE TRIGGER IF NOT EXISTS changes_trim AFTER INSERT ON changes WHEN NEW.seq % 1000 = 0 BEGIN
+    DELETE FROM changes WHERE seq <= NEW.seq - 10000;
+END;
+
+-- Full-text index over the SEARCH_FIELDS; its rowid is the ingredients rowid
+CREATE VIRTUAL TABLE IF NOT EXISTS ingredients_fts USING fts5(
+    name, synonyms, category, source, storage_conditions, comment,
+    tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+);
+"""
+
+# bm25() weights of the ingredients_fts columns
+FTS_WEIGHTS = ", ".join(str(weight) for weight in SEARCH_FIELDS.values())
+
+# GET /ingredients filter -> SQL condition
+FILTER_SQL = {
+    "place": "place = ?",
+    "category": "category = ?",
+    "source": "source = ?",
+    "vegan_level": "vegan_level = ?",
+    "diet_level": "diet_level = ?",
+    "allergene": "id IN (SELECT ingredient_id FROM ingredient_values WHERE field = 'allergenes' AND value = ?)",
+    # Lists are passed as JSON arrays of casefolded values
+    "exclude_allergens": "id NOT IN (SELECT ingredient_id FROM ingredient_values "
+                         "WHERE field = 'allergenes' AND casefold(value) IN (SELECT value FROM json_each(?)))",
+    "exclude_distaste": "id NOT IN (SELECT ingredient_id FROM ingredient_values "
+                        "WHERE field = 'personal_distaste' AND casefold(value) IN (SELECT value FROM json_each(?)))",
+    "min_vegan": "vegan_level >= ?",
+    "max_diet": "diet_level <= ?",
+}
+
+# GET /ingredients sort key -> SQL expression
+SORT_SQL = {
+    "name": "name COLLATE NOCASE",
+    "place": "place COLLATE NOCASE",
+    "shelf": "shelf",
+    "category": "category COLLATE NOCASE",
+    "source": "source COLLATE NOCASE",
+    "best_before_date": "best_before",
+    "vegan_level": "vegan_level",
+    "diet_level": "diet_level",
+    "price": "json_extract(data, '$.price')",
+}
+
+# Facet -> SQL expression, for facets kept in a column
+# Completion field -> query of its values and how many ingredients use them
+SUGGEST_SQL = {
+    "name": "SELECT value, sum(n) FROM (SELECT name AS value, count(*) AS n FROM ingredients GROUP BY name "
+            "UNION ALL SELECT value, count(*) FROM ingredient_values WHERE field = 'synonyms' GROUP BY value) "
+            "GROUP BY value",
+    "place": "SELECT place, count(*) FROM ingredients WHERE place IS NOT NULL AND place != '' GROUP BY place",
+    "source": "SELECT source, count(*) FROM ingredients WHERE source IS NOT NULL AND source != '' GROUP BY source",
+}
+
+FACET_SQL = {
+    "category": "category",
+    "location.place": "place",
+    "location.shelf": "shelf",
+    "size.unit": "json_extract(data, '$.size.unit')",
+    "source": "source",
+}
+
+#------------------ STORE -----------------------------
+
+class SQLiteIngredientStore:
+    """Ingredients database in SQLite.
+
+       Offers the same methods as IngredientStore. The full ingredient is kept
+       as JSON so the REST API returns the same shapes; the fields used for
+       filtering are copied into indexed columns and the ingredient_values
+       side table."""
+
+    # Seconds between two checks for new changes in changes()
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.create_function("casefold", 1, normalize, deterministic=True)
+        self._conn.executescript(SCHEMA)
+        self._rebuild_search_index()
+        # Completions are answered from memory; rebuilt when the database changed
+        self._suggest_index = SuggestIndex()
+        self._suggest_version = None
+        # Probable duplicates are found in memory; kept up to date from the change log
+        self._duplicate_index = None
+        self._duplicate_cursor = None
+
+    def _row(self, ingredient):
+        """Return the column values for an ingredient."""
+        location = ingredient.get("location", {})
+        best_before = parse_best_before(ingredient.get("best_before_date"))
+        return (
+            ingredient["id"],
+            ingredient["name"],
+            location.get("place"),
+            location.get("shelf"),
+            ingredient.get("category"),
+            ingredient.get("source"),
+            best_before.isoformat() if best_before else None,
+            ingredient.get("vegan_level"),
+            ingredient.get("diet_level"),
+            "\n".join(fold(field_text(ingredient, field)) for field in SEARCH_FIELDS),
+            dumps(ingredient).decode("utf-8"),
+        )
+
+    def _insert(self, ingredient):
+        """Insert an ingredient, its list values and search text (inside a transaction)."""
+        cursor = self._conn.execute("INSERT INTO ingredients VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                    self._row(ingredient))
+        self._insert_related(ingredient, cursor.lastrowid)
+
+    def _insert_related(self, ingredient, rowid):
+        values = {(field, value) for field in LIST_FIELDS for value in ingredient.get(field) or []}
+        self._conn.executemany(
+            "INSERT INTO ingredient_values (ingredient_id, field, value) VALUES (?, ?, ?)",
+            [(ingredient["id"], field, value) for field, value in values])
+        self._insert_search_text(ingredient, rowid)
+
+    def _insert_search_text(self, ingredient, rowid):
+        # Index the tokens incl. their transliterated forms ("gewuerz")
+        self._conn.execute(
+            "INSERT INTO ingredients_fts (rowid, name, synonyms, category, source, storage_conditions, comment) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (rowid, *(" ".join(tokenize(field_text(ingredient, field))) for field in SEARCH_FIELDS)))
+
+    def _rebuild_search_index(self):
+        """Fill the full-text index if it is missing rows (e.g. it was just created)."""
+        with self._lock:
+            indexed = self._conn.execute("SELECT count(*) FROM ingredients_fts").fetchone()[0]
+            total = self._conn.execute("SELECT count(*) FROM ingredients").fetchone()[0]
+            if indexed == total:
+                return
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.execute("DELETE FROM ingredients_fts")
+                for rowid, data in self._conn.execute("SELECT rowid, data FROM ingredients").fetchall():
+                    ingredient = loads(data)
+                    self._conn.execute("UPDATE ingredients SET search_text = ? WHERE rowid = ?",
+                                       (self._row(ingredient)[9], rowid))
+                    self._insert_search_text(ingredient, rowid)
+
+    def _select(self, where="", params=(), order="rowid", limit=None, offset=0):
+        rows = self._conn.execute(
+            f"SELECT data FROM ingredients {where} ORDER BY {order} LIMIT ? OFFSET ?",
+            (*params, -1 if limit is None else limit, offset))
+        return [loads(data) for (data,) in rows]
+
+    def refresh(self, force=False):
+        """Nothing to do: every read goes to the database."""
+
+    def version(self):
+        """Return (version, modified) of the data, see IngredientStore.version()."""
+        with self._lock:
+            version, modified = self._conn.execute("SELECT version, modified_at FROM db_version").fetchone()
+        return f"{version}-{modified:.6f}", modified
+
+    def disk_usage(self):
+        """Return the size of the database files in bytes."""
+        files = [self.path, self.path + "-wal"]
+        return sum(os.path.getsize(path) for path in files if os.path.exists(path))
+
+    def all(self):
+        """Return all ingredients."""
+        with self._lock:
+            return self._select()
+
+    def get(self, id):
+        """Return the ingredient with the given ID, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM ingredients WHERE id = ?", (id,)).fetchone()
+        return loads(row[0]) if row else None
+
+    def query(self, filters=None, sort=None, limit=None, offset=0):
+        """Return (total, page) of the ingredients matching the given filters
+           (see FILTER_FIELDS), ordered by a SORT_FIELDS key."""
+        filters = filters or {}
+        where = "WHERE " + " AND ".join(FILTER_SQL[key] for key in filters) if filters else ""
+        params = [json.dumps([normalize(v) for v in value]) if isinstance(value, list) else value
+                  for value in filters.values()]
+        order = "rowid"
+        if sort:
+            column = SORT_SQL[sort.lstrip("-")]
+            direction = "DESC" if sort.startswith("-") else "ASC"
+            # Ingredients without a value always come last
+            order = f"{column} IS NULL, {column} {direction}, rowid"
+        with self._lock:
+            total = self._conn.execute(f"SELECT count(*) FROM ingredients {where}", params).fetchone()[0]
+            return total, self._select(where, params, order, limit, offset)
+
+    def encode(self, ingredients):
+        """Return the JSON array (bytes) of the given ingredients. Rows are
+           parsed on every read, so there is nothing to cache here."""
+        return dumps(ingredients)
+
+    def changes(self, since=None, timeout=0):
+        """Return (cursor, events) with the change events after the cursor
+           `since`, see IngredientStore.changes(). The change log is shared by
+           all processes using the database."""
+        deadline = time.monotonic() + wait_seconds(timeout)
+        while True:
+            with self._lock:
+                epoch = self._conn.execute("SELECT value FROM meta WHERE key = 'epoch'").fetchone()[0]
+                last, first = self._conn.execute("SELECT coalesce(max(seq), 0), min(seq) FROM changes").fetchone()
+                cursor = f"{epoch}:{last}"
+                if since is None:
+                    return cursor, []
+                since_epoch, _, seq = since.partition(":")
+                if since_epoch != epoch or not (seq.isascii() and seq.isdigit()) or int(seq) > last:
+                    return cursor, None
+                if first is not None and int(seq) < first - 1:
+                    return cursor, None
+                if int(seq) < last:
+                    rows = self._conn.execute(
+                        "SELECT c.seq, c.op, c.ingredient_id, i.data FROM changes c "
+                        "LEFT JOIN ingredients i ON c.op != 'delete' AND i.id = c.ingredient_id "
+                        "WHERE c.seq > ? AND c.seq <= ? ORDER BY c.seq", (int(seq), last)).fetchall()
+                    events = []
+                    for seq, op, id, data in rows:
+                        event = {"seq": seq, "op": op, "id": id}
+                        if op != "delete":
+                            # The current version; None if it was deleted since
+                            event["ingredient"] = loads(data) if data else None
+                        events.append(event)
+                    return cursor, events
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return cursor, []
+            time.sleep(min(remaining, self.POLL_INTERVAL))
+
+    def facets(self, names=None):
+        """Return {facet: {value: count}} for the given FACET_FIELDS (default all)."""
+        result = {}
+        with self._lock:
+            for facet in names or FACET_FIELDS:
+                if facet in FACET_SQL:
+                    expr = FACET_SQL[facet]
+                    rows = self._conn.execute(
+                        f"SELECT {expr}, count(*) FROM ingredients WHERE {expr} IS NOT NULL AND {expr} != '' GROUP BY 1")
+                else:
+                    rows = self._conn.execute(
+                        "SELECT value, count(*) FROM ingredient_values WHERE field = ? GROUP BY value", (facet,))
+                result[facet] = dict(sorted(rows, key=facet_sort_key))
+        return result
+
+    def suggest(self, field, prefix, limit=10):
+        """Return completions of a prefix for one of the SUGGEST_FIELDS
+           (see SuggestIndex.suggest())."""
+        version = self.version()[0]
+        with self._lock:
+            if version != self._suggest_version:
+                for name, sql in SUGGEST_SQL.items():
+                    self._suggest_index.set_values(name, {str(value): n for value, n in self._conn.execute(sql)})
+                self._suggest_version = version
+            return self._suggest_index.suggest(field, prefix, limit)
+
+    def _duplicates(self):
+        """Return the duplicate index, updated with the changes since it was last used."""
+        with self._lock:
+            events = None
+            if self._duplicate_index is not None:
+                cursor, events = self.changes(self._duplicate_cursor)
+            if events is None:
+                cursor, _ = self.changes()
+                rows = self._conn.execute("SELECT id, name, json_extract(data, '$.synonyms') FROM ingredients")
+                self._duplicate_index = DuplicateIndex()
+                self._duplicate_index.rebuild([{"id": id, "name": name, "synonyms": loads(synonyms) if synonyms else []}
+                                               for id, name, synonyms in rows])
+            for event in events or []:
+                self._duplicate_index.remove({"id": event["id"]})
+                if event.get("ingredient"):
+                    self._duplicate_index.add(event["ingredient"])
+            self._duplicate_cursor = cursor
+            return self._duplicate_index
+
+    def _get_many(self, ids):
+        """Return the ingredients with the given IDs, in that order."""
+        rows = self._conn.execute("SELECT id, data FROM ingredients WHERE id IN (SELECT value FROM json_each(?))",
+                                  (json.dumps(ids),))
+        found = {id: loads(data) for id, data in rows}
+        return [found[id] for id in ids if id in found]
+
+    def similar(self, ingredient, threshold=None):
+        """Return [(ingredient, similarity)] of stored ingredients that are
+           probable duplicates of the given one (see DuplicateIndex.similar())."""
+        with self._lock:
+            index = self._duplicates()
+            matches = index.similar(ingredient) if threshold is None else index.similar(ingredient, threshold)
+            similarity = dict(matches)
+            return [(ing, similarity[ing["id"]]) for ing in self._get_many([id for id, _ in matches])]
+
+    def duplicates(self, threshold=None):
+        """Return groups of probable duplicates as [(ingredients, similarity)]
+           (see DuplicateIndex.duplicates())."""
+        with self._lock:
+            index = self._duplicates()
+            groups = index.duplicates() if threshold is None else index.duplicates(threshold)
+            found = {ing["id"]: ing for ing in self._get_many([id for ids, _ in groups for id in ids])}
+            return [([found[id] for id in ids if id in found], similarity) for ids, similarity in groups]
+
+    def stats(self, fields=None, group_by=None, filters=None):
+        """Return statistics of numeric fields, see ColumnIndex.stats()."""
+        fields = fields or list(STAT_FIELDS)
+        columns = []
+        for field in fields:
+            path = "$." + ".".join(STAT_FIELDS[field])
+            # Only numbers count, like NaN is skipped by the ColumnIndex
+            value = f"CASE WHEN json_type(data, '{path}') IN ('integer', 'real') THEN json_extract(data, '{path}') END"
+            columns += [f"count({value})", f"total({value})", f"min({value})", f"max({value})"]
+        group = f"NULLIF({group_by}, '')" if group_by else "NULL"
+        where = "WHERE " + " AND ".join(FILTER_SQL[key] for key in filters) if filters else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {group} AS g, count(*), {', '.join(columns)} FROM ingredients {where} "
+                "GROUP BY g ORDER BY g IS NULL, g", list((filters or {}).values())).fetchall()
+
+        def group_stats(row):
+            stats = {"count": row[1]}
+            for i, field in enumerate(fields):
+                n, total, lowest, highest = row[2 + 4 * i:6 + 4 * i]
+                stats[field] = {"count": n, "sum": float(total), "mean": total / n if n else None,
+                                "min": float(lowest) if n else None, "max": float(highest) if n else None}
+            return stats
+
+        if not group_by:
+            return group_stats(rows[0]) if rows else group_stats((None, 0) + (0, 0.0, None, None) * len(fields))
+        return [{group_by: row[0], **group_stats(row)} for row in rows]
+
+    def expiring(self, start, end, filters=None):
+        """Return the ingredients whose best before date is between start and
+           end (dates, None for an open range), soonest first."""
+        conditions = ["best_before IS NOT NULL"]
+        params = []
+        if start:
+            conditions.append("best_before >= ?")
+            params.append(start.isoformat())
+        if end:
+            conditions.append("best_before <= ?")
+            params.append(end.isoformat())
+        for key, value in (filters or {}).items():
+            conditions.append(FILTER_SQL[key])
+            params.append(value)
+        with self._lock:
+            return self._select("WHERE " + " AND ".join(conditions), params, "best_before, id")
+
+    def search(self, query):
+        """Return ingredients matching every word of the query (as a word
+           prefix), ranked with bm25. If nothing matches, the words are looked
+           up as substrings instead, e.g. "ketchup" in "Curryketchup"."""
+        words = re.findall(r"\w+", fold(query))
+        if not words:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT i.data FROM ingredients_fts JOIN ingredients i ON i.rowid = ingredients_fts.rowid "
+                f"WHERE ingredients_fts MATCH ? ORDER BY bm25(ingredients_fts, {FTS_WEIGHTS})",
+                (" ".join(f'"{word}"*' for word in words),)).fetchall()
+            if rows:
+                return [loads(data) for (data,) in rows]
+            return self._select("WHERE " + " AND ".join(["instr(search_text, ?) > 0"] * len(words)), words)
+
+    def add(self, ingredient):
+        """Add a new ingredient. Returns False if the ID already exists."""
+        FILE_WRITES.inc("sqlite")
+        with self._lock, STORE_SAVE_SECONDS.time():
+            try:
+                with self._conn:
+                    self._conn.execute("BEGIN")
+                    self._insert(ingredient)
+            except sqlite3.IntegrityError:
+                return False
+            return True
+
+    def add_many(self, ingredients):
+        """Add several ingredients in one transaction. Returns the IDs that
+           were skipped because they already exist."""
+        skipped = []
+        FILE_WRITES.inc("sqlite")
+        with self._lock, STORE_SAVE_SECONDS.time():
+            with self._conn:
+                self._conn.execute("BEGIN")
+                for ingredient in ingredients:
+                    try:
+                        self._conn.execute("SAVEPOINT add_ingredient")
+                        self._insert(ingredient)
+                        self._conn.execute("RELEASE add_ingredient")
+                    except sqlite3.IntegrityError:
+                        self._conn.execute("ROLLBACK TO add_ingredient")
+                        self._conn.execute("RELEASE add_ingredient")
+                        skipped.append(ingredient["id"])
+        return skipped
+
+    def iter_all(self):
+        """Iterate over all ingredients (for streaming exports). Uses its own
+           connection so writers are not blocked while the export runs."""
+        conn = sqlite3.connect(self.path)
+        try:
+            for (data,) in conn.execute("SELECT data FROM ingredients ORDER BY rowid"):
+                yield loads(data)
+        finally:
+            conn.close()
+
+    def update(self, id, ingredient, if_match=None):
+        """Replace the ingredient with the given ID. Returns False if it does not exist.
+           Raises ValueError if the new ID is already used by another ingredient
+           and ConflictError if its ETag is not in `if_match`."""
+        FILE_WRITES.inc("sqlite")
+        with self._lock, STORE_SAVE_SECONDS.time():
+            try:
+                with self._conn:
+                    # IMMEDIATE: no other process may write between the check and the update
+                    self._conn.execute("BEGIN IMMEDIATE")
+                    row = self._conn.execute("SELECT rowid, data FROM ingredients WHERE id = ?", (id,)).fetchone()
+                    if row is None:
+                        return False
+                    check_etag(loads(row[1]), if_match)
+                    row = row[:1]
+                    self._conn.execute(
+                        "UPDATE ingredients SET id = ?, name = ?, place = ?, shelf = ?, category = ?, source = ?, "
+                        "best_before = ?, vegan_level = ?, diet_level = ?, search_text = ?, data = ? WHERE rowid = ?",
+                        self._row(ingredient) + row)
+                    self._conn.execute("DELETE FROM ingredient_values WHERE ingredient_id = ?", (ingredient["id"],))
+                    self._conn.execute("DELETE FROM ingredients_fts WHERE rowid = ?", row)
+                    self._insert_related(ingredient, row[0])
+            except sqlite3.IntegrityError:
+                raise ValueError("Ingredient with this ID already exists")
+            return True
+
+    def delete(self, id, if_match=None):
+        """Delete the ingredient with the given ID. Returns False if it does not exist.
+           Raises ConflictError if its ETag is not in `if_match`."""
+        FILE_WRITES.inc("sqlite")
+        with self._lock, STORE_SAVE_SECONDS.time():
+            with self._conn:
+                self._conn.execute("BEGIN IMMEDIATE")
+                row = self._conn.execute("SELECT rowid, data FROM ingredients WHERE id = ?", (id,)).fetchone()
+                if row is None:
+                    return False
+                check_etag(loads(row[1]), if_match)
+                row = row[:1]
+                self._conn.execute("DELETE FROM ingredients_fts WHERE rowid = ?", row)
+                self._conn.execute("DELETE FROM ingredients WHERE rowid = ?", row)
+            return True
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
+
+#------------------ MIGRATION -----------------------------
+
+def migrate(json_path, db_path):
+    """Copy all ingredients from the JSON database (including a pending
+       journal) into a new SQLite database. Returns the number of ingredients."""
+    if os.path.exists(db_path):
+        raise FileExistsError(f"{db_path} already exists")
+    journal = os.path.exists(os.path.splitext(json_path)[0] + ".journal.jsonl")
+    source = IngredientStore(json_path, journal=journal)
+    ingredients = source.all()
+    source.close()
+
+    target = SQLiteIngredientStore(db_path)
+    with target._lock, target._conn:
+        target._conn.execute("BEGIN")
+        for ingredient in ingredients:
+            target._insert(ingredient)
+    target.close()
+    return len(ingredients)
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate the JSON ingredients database to SQLite.")
+    parser.add_argument("--json", default=os.path.join("Json", "Ingredients.json"), help="JSON database to read")
+    parser.add_argument("--db", default=os.path.join("Json", "Ingredients.db"), help="SQLite database to create")
+    args = parser.parse_args()
+    count = migrate(args.json, args.db)
+    print(f"Migrated {count} ingredients to {args.db}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import bisect
+import re
+
+from facet_index import facet_values
+from search_index import fold
+
+# Fields that can be completed -> paths of the values they are completed from
+SUGGEST_FIELDS = {
+    "name": (("name",), ("synonyms",)),
+    "place": (("location", "place"),),
+    "source": (("source",),),
+}
+
+#------------------ FUNCTIONS -----------------------------
+
+def word_keys(value):
+    """Return the folded value from the start of each of its words, so
+       "ketch" completes "Curry Ketchup" as well as "Ketchup"."""
+    text = fold(value)
+    return [text[match.start():] for match in re.finditer(r"\w+", text)] or [text]
+
+def field_values(ingredient, field):
+    return {str(value) for path in SUGGEST_FIELDS[field] for value in facet_values(ingredient, path)}
+
+#------------------ INDEX -----------------------------
+
+class SuggestIndex:
+    """Sorted arrays of the values of the SUGGEST_FIELDS for as-you-type
+       completion.
+
+       Every value is stored once per word as (folded text from that word on,
+       value), so a prefix is found with one binary search and completions
+       are read off in order; a lookup costs O(log n + limit) no matter how
+       many ingredients there are. Values are reference counted, so the
+       arrays are updated incrementally when ingredients change."""
+
+    def __init__(self):
+        self._counts = {field: {} for field in SUGGEST_FIELDS}  # field -> {value: ingredients}
+        self._keys = {field: [] for field in SUGGEST_FIELDS}    # field -> sorted [(key, value)]
+
+    def rebuild(self, ingredients):
+        """Index all ingredients from scratch."""
+        for field in SUGGEST_FIELDS:
+            counts = {}
+            for ingredient in ingredients:
+                for value in field_values(ingredient, field):
+                    counts[value] = counts.get(value, 0) + 1
+            self.set_values(field, counts)
+
+    def set_values(self, field, counts):
+        """Replace the values of a field ({value: number of ingredients})."""
+        self._counts[field] = counts
+        self._keys[field] = sorted((key, value) for value in counts for key in word_keys(value))
+
+    def add(self, ingredient):
+        """Index an ingredient."""
+        for field in SUGGEST_FIELDS:
+            counts = self._counts[field]
+            for value in field_values(ingredient, field):
+                counts[value] = counts.get(value, 0) + 1
+                if counts[value] == 1:
+                    for key in word_keys(value):
+                        bisect.insort(self._keys[field], (key, value))
+
+    def remove(self, ingredient):
+        """Remove an ingredient from the index."""
+        for field in SUGGEST_FIELDS:
+            counts = self._counts[field]
+            for value in field_values(ingredient, field):
+                counts[value] -= 1
+                if counts[value]:
+                    continue
+                del counts[value]
+                keys = self._keys[field]
+                for key in word_keys(value):
+                    i = bisect.bisect_left(keys, (key, value))
+                    if i < len(keys) and keys[i] == (key, value):
+                        del keys[i]
+
+    def suggest(self, field, prefix, limit=10):
+        """Return up to `limit` values of a field with a word starting with
+           prefix (ignoring case and accents), in alphabetical order of the
+           matching text."""
+        prefix = fold(prefix.strip())
+        if not prefix:
+            return []
+        keys = self._keys[field]
+        results = []
+        i = bisect.bisect_left(keys, (prefix,))
+        while i < len(keys) and len(results) < limit and keys[i][0].startswith(prefix):
+            if keys[i][1] not in results:
+                results.append(keys[i][1])
+            i += 1
+        return results